@@ -0,0 +1,104 @@
+import logging
+import threading
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+import nncam.nncam as nncam
+from utils.frame import Frame
+
+
+def is_no_frame_error(e: nncam.HRESULTException) -> bool:
+    """
+    Returns True if the HRESULT only means "no frame available yet" (timeout/pending).
+    """
+    hr = e.hr & 0xffffffff
+    return hr in (nncam.E_TIMEOUT, nncam.E_PENDING)
+
+
+class AcquisitionWorker(QThread):
+    """
+    Thread that owns the pull loop of an open Nncam handle.
+    Live frames are pulled with WaitImageV4 (rowPitch=-1) into frames checked out from a
+    FramePool and published through frameReady; the receiver owns one reference to each frame.
+    Acquisition is therefore never bounded by how fast the GUI can repaint.
+    Still images are pulled when requestStill() is called from the SDK callback.
+    """
+    frameReady = pyqtSignal(object)
+    stillReady = pyqtSignal(object)
+
+    WAIT_TIMEOUT_MS = 200
+
+    def __init__(self, hcam, pool, parent=None):
+        super().__init__(parent)
+        self.hcam = hcam
+        self.pool = pool
+        self.bitdepth = pool.bitdepth
+        self.framesPulled = 0
+        self.poolStarved = 0
+        self._running = False
+        self._stillPending = threading.Event()
+
+    def requestStill(self):
+        """
+        Notifies the worker that a still image is waiting in the SDK (thread-safe).
+        """
+        self._stillPending.set()
+
+    def stop(self):
+        """
+        Asks the pull loop to exit and waits for the thread to finish.
+        """
+        self._running = False
+        self.wait()
+
+    def run(self):
+        self._running = True
+        timeout = self.WAIT_TIMEOUT_MS / 1000
+        info = nncam.NncamFrameInfoV4()
+
+        while self._running:
+            if self._stillPending.is_set():
+                self._stillPending.clear()
+                self._pullStill()
+
+            frame = self.pool.acquire(timeout)
+            if frame is None:
+                # Every frame is still held downstream; leave the image in the SDK deque
+                self.poolStarved += 1
+                continue
+
+            try:
+                self.hcam.WaitImageV4(self.WAIT_TIMEOUT_MS, frame.cbuf, 0, self.bitdepth, -1, info)
+            except nncam.HRESULTException as e:
+                frame.release()
+                if not is_no_frame_error(e):
+                    logging.warning("Error pulling image: 0x%08x", e.hr & 0xffffffff)
+                continue
+
+            frame.setInfo(info)
+            self.framesPulled += 1
+            self.frameReady.emit(frame)
+
+    def _pullStill(self):
+        """
+        Pulls a pending still image into a freshly sized standalone frame and publishes it.
+        """
+        info = nncam.NncamFrameInfoV4()
+        try:
+            self.hcam.PullImageV4(None, 1, self.bitdepth, 0, info)
+        except nncam.HRESULTException:
+            return
+
+        width, height = info.v3.width, info.v3.height
+        if width <= 0 or height <= 0:
+            return
+
+        frame = Frame(width, height, self.bitdepth)
+        try:
+            self.hcam.PullImageV4(frame.cbuf, 1, self.bitdepth, -1, info)
+        except nncam.HRESULTException as e:
+            logging.warning("Error pulling still image: 0x%08x", e.hr & 0xffffffff)
+        else:
+            frame.setInfo(info)
+            frame.still = True
+            self.stillReady.emit(frame)
@@ -0,0 +1,125 @@
+import math
+
+import numpy as np
+
+PACKABLE_BITS = (10, 12, 14)
+
+
+def group_size(bits: int):
+    """
+    Returns (pixels, bytes) of the smallest group of 'bits'-bit pixels that fills whole bytes
+    (10-bit: 4 px in 5 bytes, 12-bit: 2 px in 3 bytes, 14-bit: 4 px in 7 bytes).
+    """
+    pixels = 8 // math.gcd(bits, 8)
+    return pixels, pixels * bits // 8
+
+
+def packed_size(count: int, bits: int) -> int:
+    """
+    Returns the number of bytes holding 'count' pixels packed at 'bits' bits.
+    """
+    pixels, nbytes = group_size(bits)
+    return -(-count // pixels) * nbytes
+
+
+def _overlaps(bits: int):
+    """
+    Yields (byte j, pixel k, shift) for every pixel bit range overlapping byte j of a group,
+    where 'shift' = k * bits - 8 * j is the bit offset of the pixel relative to the byte.
+    """
+    pixels, nbytes = group_size(bits)
+    for j in range(nbytes):
+        for k in range(pixels):
+            shift = k * bits - 8 * j
+            if -bits < shift < 8:
+                yield j, k, shift
+
+
+def pack(data: np.ndarray, bits: int) -> np.ndarray:
+    """
+    Packs uint16 pixels holding 'bits'-bit values into a uint8 bit stream, LSB first
+    (pixel k of a group occupies bits k*bits .. (k+1)*bits-1 of the group). Higher bits of
+    the input are discarded; a trailing partial group is padded with zero pixels.
+    Each output byte column is built with a few shifts/ORs over strided pixel columns.
+    """
+    pixels, nbytes = group_size(bits)
+    flat = data.reshape(-1)
+    if flat.size % pixels:
+        flat = np.concatenate([flat, np.zeros(pixels - flat.size % pixels, dtype=flat.dtype)])
+    groups = (flat & ((1 << bits) - 1)).reshape(-1, pixels)
+
+    out = np.empty((len(groups), nbytes), dtype=np.uint8)
+    tmp = np.empty(len(groups), dtype=np.uint16)
+    for j in range(nbytes):
+        column = None
+        for jj, k, shift in _overlaps(bits):
+            if jj != j:
+                continue
+            if shift >= 0:
+                np.left_shift(groups[:, k], shift, out=tmp)
+            else:
+                np.right_shift(groups[:, k], -shift, out=tmp)
+            if column is None:
+                column = tmp.copy()
+            else:
+                column |= tmp
+        # Only the low byte is kept
+        out[:, j] = column
+    return out.reshape(-1)
+
+
+def unpack(stream: np.ndarray, bits: int, count: int) -> np.ndarray:
+    """
+    Unpacks 'count' pixels from a bit stream produced by pack() into a uint16 array.
+    """
+    pixels, nbytes = group_size(bits)
+    groups = -(-count // pixels)
+    packed = np.frombuffer(stream, dtype=np.uint8, count=groups * nbytes).reshape(groups, nbytes)
+    mask = (1 << bits) - 1
+
+    out = np.zeros((groups, pixels), dtype=np.uint16)
+    tmp = np.empty(groups, dtype=np.uint16)
+    for j, k, shift in _overlaps(bits):
+        tmp[...] = packed[:, j]
+        if shift > 0:
+            tmp >>= shift
+        elif shift < 0:
+            tmp <<= -shift
+        out[:, k] |= tmp
+    out &= mask
+    return out.reshape(-1)[:count]
+
+
+if __name__ == "__main__":
+    # Round-trip self-check and throughput benchmark
+    import sys
+    import time
+
+    height, width = (int(v) for v in sys.argv[1:3]) if len(sys.argv) > 2 else (2048, 3072)
+    repeats = 10
+    rng = np.random.default_rng(0)
+
+    for bits in PACKABLE_BITS:
+        # Odd sizes exercise the padded last group
+        for count in (1, 3, 7, 1001):
+            small = rng.integers(0, 1 << bits, count).astype(np.uint16)
+            packedSmall = pack(small, bits)
+            assert packedSmall.size == packed_size(count, bits)
+            assert np.array_equal(unpack(packedSmall, bits, count), small), (bits, count)
+
+        data = rng.integers(0, 1 << bits, (height, width)).astype(np.uint16)
+        data[0, 0], data[-1, -1] = 0, (1 << bits) - 1
+
+        t0 = time.perf_counter()
+        for _ in range(repeats):
+            packed = pack(data, bits)
+        tPack = (time.perf_counter() - t0) / repeats
+        t0 = time.perf_counter()
+        for _ in range(repeats):
+            restored = unpack(packed, bits, data.size)
+        tUnpack = (time.perf_counter() - t0) / repeats
+        assert np.array_equal(restored.reshape(data.shape), data)
+
+        print(f"{bits}-bit {width}x{height}: {packed.nbytes / data.nbytes:.3f} of the uint16 size, "
+              f"pack {tPack * 1e3:.1f} ms ({data.nbytes / tPack / 1e6:.0f} MB/s), "
+              f"unpack {tUnpack * 1e3:.1f} ms ({data.nbytes / tUnpack / 1e6:.0f} MB/s)")
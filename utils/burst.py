@@ -0,0 +1,51 @@
+import logging
+
+import nncam.nncam as nncam
+
+# How the frames of a burst are produced
+BURST_STILL = "still"      # one SnapN: N still images
+BURST_TRIGGER = "trigger"  # software trigger mode and one Trigger(N): N live frames
+BURST_VIDEO = "video"      # no command: the next N free-running live frames
+
+# Trigger() takes an unsigned short and 0xffff means "trigger continuously"
+TRIGGER_MAX = 0xfffe
+TRIGGER_CONTINUOUS = 0xffff
+
+
+def burst_mode(model) -> str:
+    """
+    Returns how a burst is captured on a camera 'model': still snaps where the model has
+    still resolutions, otherwise software triggers when the camera accepts a multi-frame
+    trigger, otherwise free-running video frames.
+    """
+    if model.still:
+        return BURST_STILL
+    if model.flag & nncam.NNCAM_FLAG_TRIGGER_SOFTWARE and not model.flag & nncam.NNCAM_FLAG_TRIGGER_SINGLE:
+        return BURST_TRIGGER
+    return BURST_VIDEO
+
+
+def start_burst(hcam, mode: str, res: int, count: int):
+    """
+    Requests 'count' frames with a single command; the frames then stream in through the
+    acquisition worker (still images or live frames according to 'mode').
+    """
+    if mode == BURST_STILL:
+        hcam.SnapN(res, count)
+    elif mode == BURST_TRIGGER:
+        hcam.put_Option(nncam.NNCAM_OPTION_TRIGGER, 1)
+        # Longer bursts trigger continuously and are cancelled by end_burst()
+        hcam.Trigger(count if count <= TRIGGER_MAX else TRIGGER_CONTINUOUS)
+
+
+def end_burst(hcam, mode: str):
+    """
+    Cancels what is left of a burst and returns a triggered camera to video mode.
+    """
+    if mode != BURST_TRIGGER:
+        return
+    try:
+        hcam.Trigger(0)
+        hcam.put_Option(nncam.NNCAM_OPTION_TRIGGER, 0)
+    except nncam.HRESULTException as e:
+        logging.warning("Error ending the trigger burst: 0x%08x", e.hr & 0xffffffff)
@@ -0,0 +1,40 @@
+import math
+
+import numpy as np
+
+DECIMATE_STRIDE = "stride"
+DECIMATE_BIN = "bin"
+
+DECIMATE_METHODS = [DECIMATE_STRIDE, DECIMATE_BIN]
+
+
+def decimation_factor(width: int, height: int, target_width: int, target_height: int) -> int:
+    """
+    Returns the smallest integer factor that makes a width x height frame fit in the target size.
+    """
+    if target_width <= 0 or target_height <= 0:
+        return 1
+    return max(1, math.ceil(max(width / target_width, height / target_height)))
+
+
+def decimate(data: np.ndarray, factor: int, method: str = DECIMATE_STRIDE) -> np.ndarray:
+    """
+    Reduces a 2D frame by an integer factor.
+    - stride: keeps every factor-th pixel (a view, no copy)
+    - bin:    averages factor x factor blocks (trailing rows/columns are dropped)
+    The result keeps the dtype of 'data'.
+    """
+    if factor <= 1:
+        return data
+    if method == DECIMATE_STRIDE:
+        return data[::factor, ::factor]
+
+    h = data.shape[0] // factor
+    w = data.shape[1] // factor
+    # Accumulate the factor x factor strided sub-grids: small, cache-friendly additions
+    sums = np.zeros((h, w), dtype=np.uint32)
+    for i in range(factor):
+        for j in range(factor):
+            sums += data[i::factor, j::factor][:h, :w]
+    sums //= factor * factor
+    return sums.astype(data.dtype)
@@ -0,0 +1,284 @@
+import collections
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+POLICY_BLOCK = "block"
+POLICY_DROP = "drop"
+POLICY_SPILL = "spill"
+
+
+class WriteJob:
+    """
+    A pending save: the function that writes 'data' to 'path', plus its keyword arguments.
+    'frame' (optional) is the Frame that owns 'data'; it is released once the job is done.
+    Callable arguments (e.g. Frame.exactHistogram) read the frame, so they are dropped
+    when the job lets go of the frame early (detach, spill).
+    'onWritten' (optional) is called with the job by the writer thread once the write succeeded.
+    """
+    def __init__(self, path: str, writeFunc, data: np.ndarray, frame=None, onWritten=None, **kwargs):
+        self.path = path
+        self.writeFunc = writeFunc
+        self.data = data
+        self.frame = frame
+        self.onWritten = onWritten
+        self.kwargs = kwargs
+        self.nbytes = data.nbytes
+        self.enqueued = time.monotonic()
+        self.spillPath = None
+
+    def run(self):
+        self.writeFunc(self.path, self.data, **self.kwargs)
+
+    def detach(self):
+        """
+        Copies the data out of a pooled frame and releases the frame, so the job can wait
+        in the queue without holding one of the (few) pool buffers.
+        """
+        if self.frame is None or self.frame.pool is None:
+            return
+        self.data = self.data.copy()
+        self.releaseFrame()
+
+    def releaseFrame(self):
+        if self.frame is not None:
+            self.frame.release()
+            self.frame = None
+        for key, value in self.kwargs.items():
+            if callable(value):
+                self.kwargs[key] = None
+
+    def done(self):
+        """
+        Releases the resources held by the job (frame reference or spill file).
+        """
+        self.data = None
+        if self.frame is not None:
+            self.frame.release()
+            self.frame = None
+        if self.spillPath is not None:
+            try:
+                os.remove(self.spillPath)
+            except OSError:
+                pass
+            self.spillPath = None
+
+
+class DiskWriter:
+    """
+    Bounded asynchronous writer stage. Callers only enqueue WriteJobs; a pool of
+    writer threads performs the actual file writes.
+    Jobs hold a pooled frame only while the frame pool has more than POOL_RESERVE buffers
+    free; beyond that their data is copied out (detach), so the queue depth, not the pool
+    size, bounds how much is pending and acquisition keeps buffers to pull into.
+    When the queue is full the back-pressure policy decides what happens:
+    - block: the caller waits for a free slot
+    - drop:  the newest job is discarded and counted
+    - spill: the frame data is dumped to a spill file and written later
+    """
+    # Free pool frames below which queued jobs copy their data out of the pool
+    POOL_RESERVE = 2
+
+    def __init__(self, workers: int = 2, maxQueue: int = 64, policy: str = POLICY_BLOCK, spillDir=None):
+        self.policy = policy
+        self.maxQueue = maxQueue
+        self.spillDir = spillDir or os.path.join(tempfile.gettempdir(), "photsat_spill")
+        self._queue = queue.Queue(maxQueue)
+        self._spilled = collections.deque()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._retire = 0
+        self._closed = False
+
+        # Statistics
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.failed = 0
+        self.detached = 0
+        self.bytesWritten = 0
+        # Time the writer threads spent writing (excludes waiting for jobs)
+        self.busyTime = 0.0
+        self._latencies = collections.deque(maxlen=100)
+        self._lastStatsTime = time.monotonic()
+        self._lastStatsBytes = 0
+
+        self.setWorkers(workers)
+
+    def setWorkers(self, workers: int):
+        """
+        Grows or shrinks the pool of writer threads.
+        """
+        with self._lock:
+            alive = len(self._threads) - self._retire
+            for _ in range(workers - alive):
+                t = threading.Thread(target=self._run, name="DiskWriter", daemon=True)
+                self._threads.append(t)
+                t.start()
+            if workers < alive:
+                self._retire += alive - workers
+
+    def workers(self) -> int:
+        with self._lock:
+            return len(self._threads) - self._retire
+
+    def submit(self, job: WriteJob) -> bool:
+        """
+        Enqueues a job according to the back-pressure policy.
+        Returns False if the job was dropped.
+        """
+        if self._closed:
+            job.done()
+            return False
+
+        if job.frame is not None and job.frame.pool is not None and job.frame.pool.available() < self.POOL_RESERVE:
+            job.detach()
+            with self._lock:
+                self.detached += 1
+
+        if self.policy == POLICY_BLOCK:
+            self._queue.put(job)
+            return True
+
+        try:
+            self._queue.put_nowait(job)
+            return True
+        except queue.Full:
+            pass
+
+        if self.policy == POLICY_SPILL:
+            try:
+                self._spill(job)
+                return True
+            except OSError:
+                logging.exception("Error spilling %s", job.path)
+
+        with self._lock:
+            self.dropped += 1
+        logging.warning("Disk writer queue full, dropped %s", job.path)
+        job.done()
+        return False
+
+    def _spill(self, job: WriteJob):
+        """
+        Dumps the job's data to a spill file and releases its frame, so acquisition can continue.
+        """
+        os.makedirs(self.spillDir, exist_ok=True)
+        fd, spillPath = tempfile.mkstemp(suffix=".npy", dir=self.spillDir)
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, job.data)
+        job.releaseFrame()
+        job.data = None
+        job.spillPath = spillPath
+        with self._lock:
+            self._spilled.append(job)
+            self.spilled += 1
+
+    def _nextJob(self):
+        """
+        Returns the next job: queued jobs first, then spilled ones (reloaded from disk).
+        Waits briefly and returns None if there is nothing to do.
+        """
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            job = self._spilled.popleft() if self._spilled else None
+        if job is None:
+            try:
+                return self._queue.get(timeout=0.2)
+            except queue.Empty:
+                return None
+        job.data = np.load(job.spillPath)
+        return job
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._retire > 0:
+                    self._retire -= 1
+                    self._threads.remove(threading.current_thread())
+                    return
+            job = self._nextJob()
+            if job is None:
+                if self._closed:
+                    return
+                continue
+            t0 = time.monotonic()
+            try:
+                job.run()
+            except Exception:
+                logging.exception("Error writing %s", job.path)
+                with self._lock:
+                    self.failed += 1
+            else:
+                with self._lock:
+                    self.written += 1
+                    self.bytesWritten += job.nbytes
+                    self.busyTime += time.monotonic() - t0
+                    self._latencies.append(time.monotonic() - job.enqueued)
+                if job.onWritten is not None:
+                    try:
+                        job.onWritten(job)
+                    except Exception:
+                        logging.exception("Error in the completion callback of %s", job.path)
+            finally:
+                job.done()
+
+    def pending(self) -> int:
+        """
+        Returns the number of jobs waiting to be written (queued plus spilled).
+        """
+        with self._lock:
+            return self._queue.qsize() + len(self._spilled)
+
+    def writeRate(self):
+        """
+        Returns the measured sustainable write rate (bytes/s with all writer threads busy),
+        or None before anything was written.
+        """
+        with self._lock:
+            if self.busyTime <= 0:
+                return None
+            return self.bytesWritten / self.busyTime * (len(self._threads) - self._retire)
+
+    def stats(self) -> dict:
+        """
+        Returns queue depth, throughput since the previous call (bytes/s),
+        average/max per-file latency (s) and counters.
+        """
+        now = time.monotonic()
+        with self._lock:
+            elapsed = now - self._lastStatsTime
+            rate = (self.bytesWritten - self._lastStatsBytes) / elapsed if elapsed > 0 else 0.0
+            self._lastStatsTime = now
+            self._lastStatsBytes = self.bytesWritten
+            latencies = list(self._latencies)
+            return {
+                "queue": self._queue.qsize(),
+                "spilledPending": len(self._spilled),
+                "maxQueue": self.maxQueue,
+                "bytesPerSec": rate,
+                "latencyAvg": sum(latencies) / len(latencies) if latencies else 0.0,
+                "latencyMax": max(latencies) if latencies else 0.0,
+                "written": self.written,
+                "dropped": self.dropped,
+                "spilled": self.spilled,
+                "detached": self.detached,
+                "failed": self.failed,
+            }
+
+    def close(self, timeout: float = 30.0):
+        """
+        Stops accepting jobs and waits (up to 'timeout' seconds) for the pending ones to be written.
+        """
+        self._closed = True
+        deadline = time.monotonic() + timeout
+        for t in list(self._threads):
+            t.join(max(0.0, deadline - time.monotonic()))
@@ -0,0 +1,128 @@
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utils.frame_stats import frame_stats, stats_cards
+
+COMPRESSION_NONE = "NONE"
+COMPRESSION_RICE = "RICE_1"
+COMPRESSION_GZIP = "GZIP_1"
+COMPRESSION_GZIP_SHUFFLE = "GZIP_2"
+
+COMPRESSION_TYPES = [COMPRESSION_NONE, COMPRESSION_RICE, COMPRESSION_GZIP, COMPRESSION_GZIP_SHUFFLE]
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Attaches to a shared memory block owned (and unlinked) by the submitting process.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no 'track' argument; pool workers share the parent's resource
+        # tracker, so the extra registration is harmless
+        return shared_memory.SharedMemory(name=name)
+
+
+def _compress_worker(path: str, shmName: str, shape, dtype, cards: dict, bitdepth: int, compression: str):
+    """
+    Runs in a pool process: writes the frame held in shared memory as a tile-compressed
+    FITS file. Returns (pid, raw bytes, file bytes, seconds).
+    """
+    from astropy.io import fits
+
+    t0 = time.perf_counter()
+    shm = _attach(shmName)
+    try:
+        data = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        hdr = fits.Header()
+        for key, value in cards.items():
+            hdr[key] = value
+        for key, value in stats_cards(frame_stats(data, bitdepth)).items():
+            hdr[key] = value
+        hdu = fits.CompImageHDU(data=data, header=hdr, compression_type=compression)
+        fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(path, overwrite=True)
+        del data, hdu
+    finally:
+        shm.close()
+    return os.getpid(), int(np.prod(shape)) * np.dtype(dtype).itemsize, os.path.getsize(path), time.perf_counter() - t0
+
+
+class CompressionPool:
+    """
+    Writes Rice/GZIP tile-compressed FITS files (astropy CompImageHDU) in a pool of worker
+    processes, so the compression never competes for the GIL with acquisition or the GUI.
+    Frames reach the workers through shared memory: one copy into a SharedMemory block,
+    no pickling of the pixel data. Per-worker compression ratio and throughput are kept
+    to help size the pool. Workers are spawned, not forked, as the GUI process is multi-threaded.
+    """
+    def __init__(self, workers: int = 2):
+        self._workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        # pid -> [files, raw bytes, compressed bytes, busy seconds]
+        self._stats = {}
+
+    def setWorkers(self, workers: int):
+        """
+        Changes the number of worker processes; the pool is recreated on the next submit.
+        """
+        with self._lock:
+            if workers == self._workers:
+                return
+            self._workers = workers
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    self._workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def write(self, path: str, data: np.ndarray, cards: dict, bitdepth: int, compression: str):
+        """
+        Compresses 'data' into 'path' in a worker process and waits for it to finish
+        (meant to be called from a disk writer thread, which keeps the back-pressure).
+        """
+        shm = shared_memory.SharedMemory(create=True, size=max(1, data.nbytes))
+        try:
+            np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)[...] = data
+            future = self._pool().submit(_compress_worker, path, shm.name, data.shape, data.dtype.str,
+                                         cards, bitdepth, compression)
+            pid, rawBytes, fileBytes, seconds = future.result()
+        finally:
+            shm.close()
+            shm.unlink()
+        with self._lock:
+            entry = self._stats.setdefault(pid, [0, 0, 0, 0.0])
+            entry[0] += 1
+            entry[1] += rawBytes
+            entry[2] += fileBytes
+            entry[3] += seconds
+
+    def stats(self) -> list:
+        """
+        Returns one dict per worker process: pid, files, compression ratio and
+        throughput (uncompressed MB/s while busy).
+        """
+        with self._lock:
+            return [{
+                "pid": pid,
+                "files": files,
+                "ratio": raw / comp if comp else 0.0,
+                "mbPerSec": raw / seconds / 1e6 if seconds else 0.0,
+            } for pid, (files, raw, comp, seconds) in sorted(self._stats.items())]
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
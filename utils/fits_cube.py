@@ -0,0 +1,148 @@
+import logging
+import math
+import os
+
+import numpy as np
+
+from utils.fits_writer import CARD_LENGTH, FitsWriter, format_card, _padding, _write_all
+from utils.slotted_output import FRAME_COLUMNS, SlottedOutput, mapped_slots, preallocate
+
+# FITS binary table formats of the FRAME_COLUMNS types
+TFORMS = {"i8": "K", "i4": "J", "f8": "D", "f4": "E"}
+
+
+def finalized_seqs(path: str):
+    """
+    Returns the SEQ column of the FRAMES table of a closed cube (-1 marks an empty slot), or
+    None if the cube was never finalized (an interrupted run: NAXIS3 may still be the
+    preallocated capacity and the slots are not known to be written).
+    """
+    from astropy.io import fits
+    with fits.open(path, memmap=False) as hdul:
+        if "FRAMES" not in hdul:
+            return None
+        return np.array(hdul["FRAMES"].data["SEQ"])
+
+
+class FitsCube(SlottedOutput):
+    """
+    Streams frames of a fixed shape into a single FITS file with an (N, h, w) primary array.
+    Every frame is written at 'slot * frameBytes' past the header.
+    - streaming (capacity=None): the file is created with NAXIS3 = 0 and NAXIS3 is patched
+      after each frame, so an interrupted cube still holds the frames written so far
+    - preallocated (capacity=N, e.g. a known trigger count): the first slots (up to
+      PREALLOCATE_CHUNK_BYTES) are allocated up front and encoded straight into an np.memmap
+      of the data area, leaving the page flushing to the kernel; later frames are written
+      after it, the file growing chunk by chunk
+    Closing sets the final NAXIS3, trims unused preallocated space and adds a FRAMES binary
+    table with the per-frame metadata (FRAME_COLUMNS).
+    """
+    def __init__(self, path: str, shape, dtype, cards: dict, capacity: int = None):
+        super().__init__(path)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.frameBytes = self.dtype.itemsize * math.prod(self.shape)
+        self.capacity = mapped_slots(capacity, self.frameBytes)
+        self._encoder = FitsWriter()
+
+        cubeCards = dict(cards)
+        cubeCards['EXTEND'] = (True, "FRAMES table with per-frame metadata follows")
+        header = self._encoder.header((self.capacity,) + self.shape, self.dtype, cubeCards)
+        self._naxis3Offset = header.index(b"NAXIS3  =")
+        self._dataOffset = len(header)
+
+        flags = os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+        self._fd = os.open(path, flags, 0o666)
+        _write_all(self._fd, [header])
+
+        self._map = None
+        if self.capacity:
+            dataBytes = self.capacity * self.frameBytes
+            self._allocated = self._dataOffset + dataBytes + _padding(dataBytes)
+            try:
+                preallocate(self._fd, self._allocated)
+            except OSError:
+                os.close(self._fd)
+                os.remove(path)
+                raise
+            fitsType = ">u2" if self.dtype == np.uint16 else self.dtype
+            self._map = np.memmap(path, dtype=fitsType, mode="r+", offset=self._dataOffset,
+                                  shape=(self.capacity,) + self.shape)
+
+    def _write(self, data: np.ndarray, slot: int, row: dict):
+        if data.shape != self.shape or data.dtype != self.dtype:
+            raise ValueError(f"Frame {data.shape} {data.dtype} does not match the cube "
+                             f"{self.shape} {self.dtype}")
+        if slot < self.capacity:
+            # Slots are disjoint, so the mapped copies need no lock
+            if self.dtype == np.uint16:
+                np.bitwise_xor(data, 0x8000, out=self._map[slot])
+            else:
+                self._map[slot] = data
+            with self._lock:
+                self._recordFrame(slot, row)
+        else:
+            body = self._encoder.encode(data)
+            with self._lock:
+                self._grow(self._fd, self._dataOffset + (slot + 1) * self.frameBytes)
+                os.lseek(self._fd, self._dataOffset + slot * self.frameBytes, os.SEEK_SET)
+                _write_all(self._fd, [body.reshape(-1).view(np.uint8)])
+                self._recordFrame(slot, row)
+                if not self.capacity:
+                    self._patchNaxis3(self._length)
+
+    def _patchNaxis3(self, n: int):
+        os.lseek(self._fd, self._naxis3Offset, os.SEEK_SET)
+        _write_all(self._fd, [format_card("NAXIS3", n)])
+
+    def _finalize(self):
+        fd = self._fd
+        try:
+            if self._map is not None:
+                self._map.flush()
+                self._map = None
+            self._patchNaxis3(self._length)
+            self._blankEmptySlots()
+            dataBytes = self._length * self.frameBytes
+            end = self._dataOffset + dataBytes
+            os.ftruncate(fd, end)
+            os.lseek(fd, end, os.SEEK_SET)
+            table = self.metadataTable()
+            table = table.astype(table.dtype.newbyteorder(">"))
+            _write_all(fd, [bytes(_padding(dataBytes)), self._tableHeader(table), table.tobytes(),
+                            bytes(_padding(table.nbytes))])
+        finally:
+            self._fd = None
+            os.close(fd)
+        logging.info("FITS cube closed: %s (%d frames)", self.path, self.frames)
+
+    def _blankEmptySlots(self):
+        # Zero bytes would read back as BZERO (32768), so empty slots get an encoded zero frame
+        empty = [slot for slot in range(self._length) if slot not in self._rows]
+        if not empty or self.dtype != np.uint16:
+            return
+        blank = self._encoder.encode(np.zeros(self.shape, dtype=self.dtype)).reshape(-1).view(np.uint8)
+        for slot in empty:
+            os.lseek(self._fd, self._dataOffset + slot * self.frameBytes, os.SEEK_SET)
+            _write_all(self._fd, [blank])
+
+    def _tableHeader(self, table: np.ndarray) -> bytes:
+        parts = [
+            format_card("XTENSION", "BINTABLE", "binary table extension"),
+            format_card("BITPIX", 8, "array data type"),
+            format_card("NAXIS", 2, "number of array dimensions"),
+            format_card("NAXIS1", table.dtype.itemsize, "length of dimension 1"),
+            format_card("NAXIS2", len(table), "length of dimension 2"),
+            format_card("PCOUNT", 0, "number of group parameters"),
+            format_card("GCOUNT", 1, "number of groups"),
+            format_card("TFIELDS", len(FRAME_COLUMNS), "number of table fields"),
+        ]
+        for i, (name, npType, unit) in enumerate(FRAME_COLUMNS, 1):
+            parts.append(format_card(f"TTYPE{i}", name))
+            parts.append(format_card(f"TFORM{i}", TFORMS[npType]))
+            if unit:
+                parts.append(format_card(f"TUNIT{i}", unit))
+        parts.append(format_card("EXTNAME", "FRAMES", "per-frame metadata"))
+        parts.append(b"END".ljust(CARD_LENGTH))
+        header = b"".join(parts)
+        return header + b" " * _padding(len(header))
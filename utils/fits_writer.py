@@ -0,0 +1,210 @@
+import os
+import threading
+
+import numpy as np
+
+FITS_BLOCK = 2880
+CARD_LENGTH = 80
+
+
+def format_card(key: str, value, comment: str = None) -> bytes:
+    """
+    Formats one 80-character FITS header card (fixed format for numbers and logicals).
+    """
+    if isinstance(value, (bool, np.bool_)):
+        field = ("T" if value else "F").rjust(20)
+    elif isinstance(value, (int, np.integer)):
+        field = str(int(value)).rjust(20)
+    elif isinstance(value, (float, np.floating)):
+        text = f"{float(value):.16G}"
+        if "." not in text and "E" not in text and "N" not in text:
+            text += ".0"
+        field = text.rjust(20)
+    else:
+        text = str(value).replace("'", "''")
+        field = f"'{text.ljust(8)}'".ljust(20)
+
+    card = f"{key.upper():<8}= {field}"
+    if comment:
+        card += f" / {comment}"
+    return card[:CARD_LENGTH].ljust(CARD_LENGTH).encode("ascii", "replace")
+
+
+def _padding(size: int) -> int:
+    return -size % FITS_BLOCK
+
+
+class FitsWriter:
+    """
+    Writes single-HDU FITS files for fixed-shape uint8/uint16 frames without astropy.
+    The structural cards (SIMPLE, BITPIX, NAXISn, BZERO/BSCALE) are built once per
+    shape/dtype and only the per-frame cards are formatted on each call. uint16 data
+    is stored as BITPIX=16 with BZERO=32768: the sign flip and the big-endian byte swap
+    are done in one pass into a buffer reused per thread, and header, data and padding
+    go out with a single os.writev (plain writes where writev is unavailable).
+    """
+    def __init__(self):
+        self._templates = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def template(self, shape, dtype) -> bytes:
+        """
+        Returns the (cached) structural header cards for frames of 'shape' and 'dtype'.
+        """
+        key = (tuple(shape), np.dtype(dtype))
+        with self._lock:
+            cards = self._templates.get(key)
+        if cards is not None:
+            return cards
+
+        if key[1] == np.uint8:
+            bitpix, bzero = 8, None
+        elif key[1] == np.uint16:
+            bitpix, bzero = 16, 32768
+        else:
+            raise ValueError(f"Unsupported FITS data type: {key[1]}")
+
+        parts = [
+            format_card("SIMPLE", True, "conforms to FITS standard"),
+            format_card("BITPIX", bitpix, "array data type"),
+            format_card("NAXIS", len(shape), "number of array dimensions"),
+        ]
+        # FITS axes run fastest-first, the reverse of numpy's shape
+        for i, n in enumerate(reversed(shape), 1):
+            parts.append(format_card(f"NAXIS{i}", n))
+        if bzero is not None:
+            parts.append(format_card("BZERO", bzero, "offset data range to that of unsigned short"))
+            parts.append(format_card("BSCALE", 1))
+        cards = b"".join(parts)
+
+        with self._lock:
+            self._templates[key] = cards
+        return cards
+
+    def header(self, shape, dtype, cards: dict) -> bytes:
+        """
+        Returns the padded header block: the structural template followed by 'cards'
+        (keyword -> value or (value, comment)).
+        """
+        parts = [self.template(shape, dtype)]
+        for key, value in cards.items():
+            if isinstance(value, tuple):
+                parts.append(format_card(key, *value))
+            else:
+                parts.append(format_card(key, value))
+        parts.append(b"END".ljust(CARD_LENGTH))
+        header = b"".join(parts)
+        return header + b" " * _padding(len(header))
+
+    def encode(self, data: np.ndarray) -> np.ndarray:
+        """
+        Returns the big-endian FITS representation of 'data'. For uint16 it lives in a
+        per-thread buffer that is overwritten by the next call on the same thread.
+        """
+        if data.dtype == np.uint8:
+            return np.ascontiguousarray(data)
+
+        buf = getattr(self._local, "buf", None)
+        if buf is None or buf.shape != data.shape:
+            buf = np.empty(data.shape, dtype=">u2")
+            self._local.buf = buf
+        # value - 32768 as int16 has the same bits as value ^ 0x8000; writing into a
+        # big-endian output does the byte swap in the same pass
+        np.bitwise_xor(data, 0x8000, out=buf)
+        return buf
+
+    def write(self, path: str, data: np.ndarray, cards: dict):
+        """
+        Writes 'data' with the header 'cards' to 'path', replacing any existing file.
+        """
+        header = self.header(data.shape, data.dtype, cards)
+        body = self.encode(data)
+        buffers = [header, body.reshape(-1).view(np.uint8)]
+        pad = _padding(body.nbytes)
+        if pad:
+            buffers.append(bytes(pad))
+
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+        fd = os.open(path, flags, 0o666)
+        try:
+            _write_all(fd, buffers)
+        finally:
+            os.close(fd)
+
+
+def _write_all(fd: int, buffers):
+    """
+    Writes every buffer to 'fd', with os.writev when available, handling short writes.
+    """
+    views = [memoryview(b) for b in buffers if len(b)]
+    if not hasattr(os, "writev"):
+        for view in views:
+            while view:
+                view = view[os.write(fd, view):]
+        return
+
+    while views:
+        written = os.writev(fd, views)
+        while views and written >= len(views[0]):
+            written -= len(views[0])
+            views.pop(0)
+        if written:
+            views[0] = views[0][written:]
+
+
+if __name__ == "__main__":
+    # Benchmark against the astropy path and check that astropy reads the files back
+    import sys
+    import tempfile
+    import time
+
+    from astropy.io import fits
+
+    def write_astropy(path, data, cards):
+        hdr = fits.Header()
+        for key, value in cards.items():
+            hdr[key] = value
+        fits.HDUList([fits.PrimaryHDU(data=data, header=hdr)]).writeto(path, overwrite=True)
+
+    height, width = (int(v) for v in sys.argv[1:3]) if len(sys.argv) > 2 else (2048, 3072)
+    repeats = 20
+    cards = {
+        'EXPTIME': (0.125, "Exposure time in seconds"),
+        'GAIN': (100, "Gain in percentage"),
+        'TEMP': -10.5,
+        'CAMERA': "O'Brien cam",
+        'CAPTIME': "2024-01-01T00:00:00",
+        'DATAMEAN': "1234.500",
+    }
+    writer = FitsWriter()
+    rng = np.random.default_rng(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for dtype, top in ((np.uint8, 256), (np.uint16, 4096), (np.uint16, 65536)):
+            data = rng.integers(0, top, (height, width)).astype(dtype)
+            data[0, 0], data[-1, -1] = 0, top - 1
+
+            # New file per frame, as during a capture
+            timings = {}
+            for name, func in (("astropy", write_astropy), ("fast", writer.write)):
+                t0 = time.perf_counter()
+                for i in range(repeats):
+                    func(os.path.join(tmp, f"{name}{i}.fits"), data, cards)
+                timings[name] = (time.perf_counter() - t0) / repeats
+            fast = os.path.join(tmp, "fast0.fits")
+
+            with fits.open(fast) as hdul:
+                hdul.verify("exception")
+                assert hdul[0].data.dtype == dtype
+                assert np.array_equal(hdul[0].data, data)
+                for key, value in cards.items():
+                    expected = value[0] if isinstance(value, tuple) else value
+                    assert hdul[0].header[key] == expected, key
+            assert os.path.getsize(fast) % FITS_BLOCK == 0
+
+            print(f"{np.dtype(dtype).name:>6} 0..{top - 1:<5} {width}x{height}: "
+                  f"astropy {timings['astropy'] * 1e3:7.2f} ms, fast {timings['fast'] * 1e3:7.2f} ms "
+                  f"({timings['astropy'] / timings['fast']:.1f}x)")
+            for name in os.listdir(tmp):
+                os.remove(os.path.join(tmp, name))
@@ -0,0 +1,75 @@
+import ctypes
+
+import numpy as np
+
+from utils.histogram import Histogram
+from utils.frame_stats import integer_histogram
+
+
+class Frame:
+    """
+    A camera frame: an unpadded ctypes buffer pulled with rowPitch=-1, exposed as a
+    contiguous (height, width) numpy view, plus the NncamFrameInfoV4 metadata.
+    Pooled frames are reference counted and go back to their pool when the last
+    holder releases them; standalone frames (pool=None) are simply garbage collected.
+    """
+    def __init__(self, width: int, height: int, bitdepth: int, pool=None):
+        self.pool = pool
+        self.width = width
+        self.height = height
+        self.bitdepth = bitdepth
+        dtype = np.uint16 if bitdepth > 8 else np.uint8
+        self.rowPitch = width * np.dtype(dtype).itemsize
+        self.cbuf = ctypes.create_string_buffer(self.rowPitch * height)
+        self.data = np.frombuffer(self.cbuf, dtype=dtype).reshape((height, width))
+        self.still = False
+        self.seq = 0
+        self.timestamp = 0
+        self.expotime = 0
+        self.expogain = 0
+        self.blacklevel = 0
+        # Exact Histogram of this frame, computed once by exactHistogram()
+        self.histogram = None
+        self._refs = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes
+
+    def setInfo(self, info):
+        """
+        Copies the per-frame fields of an NncamFrameInfoV4 filled by PullImageV4/WaitImageV4.
+        """
+        self.seq = info.v3.seq
+        self.timestamp = info.v3.timestamp
+        self.expotime = info.v3.expotime
+        self.expogain = info.v3.expogain
+        self.blacklevel = info.v3.blacklevel
+        self.histogram = None
+
+    def exactHistogram(self) -> Histogram:
+        """
+        Returns the exact Histogram of the frame, counting the pixels on the first call only;
+        the FITS statistics (writer thread) and the live display share it.
+        """
+        histogram = self.histogram
+        if histogram is None:
+            # Two threads may both count the first time; the results are identical
+            histogram = Histogram(integer_histogram(self.data, self.bitdepth), self.bitdepth, 1, self.seq)
+            self.histogram = histogram
+        return histogram
+
+    def retain(self):
+        """
+        Adds a holder to the frame and returns it, for chaining.
+        """
+        if self.pool is not None:
+            self.pool._retain(self)
+        return self
+
+    def release(self):
+        """
+        Drops a holder; pooled frames return to the pool when no holders remain.
+        """
+        if self.pool is not None:
+            self.pool._release(self)
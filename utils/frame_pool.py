@@ -0,0 +1,48 @@
+import threading
+
+from utils.frame import Frame
+
+
+class FramePool:
+    """
+    Fixed-size pool of preallocated, unpadded frames (rows are pulled with rowPitch=-1).
+    Frames are checked out with acquire(), pulled into, handed to consumers
+    and returned with release().
+    """
+    def __init__(self, width: int, height: int, bitdepth: int, count: int = 8):
+        self.width = width
+        self.height = height
+        self.bitdepth = bitdepth
+        self._cond = threading.Condition()
+        self._free = [Frame(width, height, bitdepth, self) for _ in range(count)]
+        self.count = count
+
+    def available(self) -> int:
+        """
+        Returns the number of frames currently free.
+        """
+        with self._cond:
+            return len(self._free)
+
+    def acquire(self, timeout=None):
+        """
+        Checks out a free frame (holding one reference).
+        Waits up to 'timeout' seconds and returns None if the pool stays exhausted.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._free, timeout):
+                return None
+            frame = self._free.pop()
+            frame._refs = 1
+            return frame
+
+    def _retain(self, frame: Frame):
+        with self._cond:
+            frame._refs += 1
+
+    def _release(self, frame: Frame):
+        with self._cond:
+            frame._refs -= 1
+            if frame._refs == 0:
+                self._free.append(frame)
+                self._cond.notify()
@@ -0,0 +1,59 @@
+import numpy as np
+
+
+def integer_histogram(data: np.ndarray, bitdepth: int) -> np.ndarray:
+    """
+    Returns the exact bincount of 'data' over 0..2**bitdepth-1 (values above land in the last bin).
+    """
+    nbins = 2**bitdepth
+    counts = np.bincount(data.ravel(), minlength=nbins)
+    if counts.size > nbins:
+        counts[nbins - 1] += counts[nbins:].sum()
+        counts = counts[:nbins]
+    return counts
+
+
+def frame_stats(data: np.ndarray, bitdepth: int, histogram=None) -> dict:
+    """
+    Computes exact min, max, median, mean, std and the saturated-pixel count of an integer
+    frame from a single bincount pass. An exact Histogram of the same frame (e.g. the one
+    computed for the live display) is reused instead of counting again.
+    """
+    if histogram is not None and histogram.exact:
+        counts = histogram.counts
+    else:
+        counts = integer_histogram(data, bitdepth)
+
+    n = int(counts.sum())
+    values = np.arange(counts.size, dtype=np.float64)
+    nonzero = np.flatnonzero(counts)
+    mean = float(np.dot(counts, values)) / n
+    var = float(np.dot(counts, (values - mean) ** 2)) / n
+
+    # Median as numpy defines it: average of the two middle order statistics
+    cum = np.cumsum(counts)
+    lower = int(np.searchsorted(cum, (n - 1) // 2, side='right'))
+    upper = int(np.searchsorted(cum, n // 2, side='right'))
+
+    return {
+        "mean": mean,
+        "median": (lower + upper) / 2,
+        "std": var ** 0.5,
+        "min": int(nonzero[0]),
+        "max": int(nonzero[-1]),
+        "saturated": int(counts[-1]),
+    }
+
+
+def stats_cards(stats: dict) -> dict:
+    """
+    Returns the FITS header cards (DATAMEAN, DATAMED, DATASTD, DATAMAX, DATAMIN, SATPIX) for 'stats'.
+    """
+    return {
+        'DATAMEAN': f"{stats['mean']:.3f}",
+        'DATAMED': f"{stats['median']:.3f}",
+        'DATASTD': f"{stats['std']:.3f}",
+        'DATAMAX': f"{stats['max']:.3f}",
+        'DATAMIN': f"{stats['min']:.3f}",
+        'SATPIX': (stats['saturated'], "Pixels at the maximum value of the bit depth"),
+    }
@@ -0,0 +1,91 @@
+import logging
+
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+from utils.slotted_output import FRAME_COLUMNS, SlottedOutput
+
+ARCHIVE_FILTERS = [None, "lzf", "gzip"]
+
+
+def finalized_seqs(path: str):
+    """
+    Returns the SEQ column of a closed archive (-1 marks an empty slot), or None if the
+    archive was never finalized (or h5py is missing).
+    """
+    if h5py is None:
+        return None
+    with h5py.File(path, "r") as f:
+        if "NFRAMES" not in f.attrs:
+            return None
+        return f["metadata/SEQ"][...]
+
+
+class Hdf5Archive(SlottedOutput):
+    """
+    Session archive in a single HDF5 file (optional dependency: h5py):
+    - /frames:     (N, h, w) dataset growing along the first axis, one chunk per frame and an
+                   optional lossless filter (lzf or gzip, with shuffle), so frame i is read
+                   directly with f["frames"][i]
+    - /metadata/*: one 1-D dataset per FRAME_COLUMNS field (SEQ, TIMESTAMP, EXPTIME, ...),
+                   read column-wise without touching the frames
+    - file attributes: the FITS cards describing the session (camera, geometry, ...)
+    """
+    def __init__(self, path: str, shape, dtype, cards: dict, compression: str = None):
+        if h5py is None:
+            raise RuntimeError("HDF5 archives need the h5py package")
+        super().__init__(path)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+        self._file = h5py.File(path, "w", libver="latest")
+        for key, value in cards.items():
+            self._file.attrs[key] = value[0] if isinstance(value, tuple) else value
+        self._frames = self._file.create_dataset(
+            "frames", shape=(0,) + self.shape, maxshape=(None,) + self.shape,
+            chunks=(1,) + self.shape, dtype=self.dtype,
+            compression=compression, shuffle=compression is not None)
+        self._frames.attrs["CLASS"] = "IMAGE_STACK"
+
+        meta = self._file.create_group("metadata")
+        self._columns = {}
+        for name, npType, unit in FRAME_COLUMNS:
+            column = meta.create_dataset(name, shape=(0,), maxshape=(None,), chunks=(1024,), dtype=npType)
+            if unit:
+                column.attrs["unit"] = unit
+            self._columns[name] = column
+
+    def _write(self, data: np.ndarray, slot: int, row: dict):
+        if data.shape != self.shape or data.dtype != self.dtype:
+            raise ValueError(f"Frame {data.shape} {data.dtype} does not match the archive "
+                             f"{self.shape} {self.dtype}")
+        with self._lock:
+            if slot >= self._frames.shape[0]:
+                self._resize(slot + 1)
+            self._frames[slot] = data
+            for name, _, _ in FRAME_COLUMNS:
+                value = row.get(name)
+                if isinstance(value, (int, float, np.number)):
+                    self._columns[name][slot] = value
+            self._recordFrame(slot, row)
+
+    def _resize(self, length: int):
+        self._frames.resize(length, axis=0)
+        for column in self._columns.values():
+            column.resize((length,))
+
+    def _finalize(self):
+        try:
+            # Rewrite the columns in full so empty slots (dropped frames) are marked
+            self._resize(self._length)
+            table = self.metadataTable()
+            for name, column in self._columns.items():
+                column[...] = table[name]
+            self._file.attrs["NFRAMES"] = self.frames
+        finally:
+            self._file.close()
+        logging.info("HDF5 archive closed: %s (%d frames)", self.path, self.frames)
@@ -0,0 +1,41 @@
+import numpy as np
+
+from utils.frame_stats import integer_histogram
+
+
+class Histogram:
+    """
+    Integer histogram of a frame over its native range (one bin per possible value).
+    'step' is the subsampling step used (1 means every pixel was counted, i.e. exact),
+    'seq' the sequence number of the frame it was computed from.
+    """
+    def __init__(self, counts: np.ndarray, bitdepth: int, step: int = 1, seq=None):
+        self.counts = counts
+        self.bitdepth = bitdepth
+        self.step = step
+        self.seq = seq
+
+    @property
+    def exact(self) -> bool:
+        return self.step == 1
+
+
+class HistogramEngine:
+    """
+    Computes integer histograms with np.bincount over the native range 0..2**bitdepth-1,
+    optionally on a strided subsample of about SAMPLE_PIXELS pixels.
+    """
+    SAMPLE_PIXELS = 262144
+
+    def __init__(self, subsample: bool = True):
+        self.subsample = subsample
+
+    def compute(self, data: np.ndarray, bitdepth: int, seq=None) -> Histogram:
+        """
+        Returns the Histogram of 'data'. Values above the bit depth range land in the last bin.
+        """
+        step = 1
+        if self.subsample:
+            step = max(1, int(np.sqrt(data.size / self.SAMPLE_PIXELS)))
+        src = data[::step, ::step] if step > 1 else data
+        return Histogram(integer_histogram(src, bitdepth), bitdepth, step, seq)
@@ -0,0 +1,80 @@
+import logging
+
+import nncam.nncam as nncam
+
+# Number of groups a camera-side sequencer program can hold (NNCAM_OPTION_SEQUENCER_NUMBER)
+SEQUENCER_MAX_STEPS = 255
+# Index of the first group in NNCAM_OPTION_SEQUENCER_EXPOTIME/EXPOGAIN | index; the SDK
+# documents the third group as index 3
+SEQUENCER_FIRST_INDEX = 1
+
+
+def sequencer_supported(hcam) -> bool:
+    """
+    Returns True if the camera implements the sequencer trigger (the SDK has no capability
+    flag for it, so the option is probed; unsupported models fail with E_NOTIMPL).
+    """
+    try:
+        hcam.get_Option(nncam.NNCAM_OPTION_SEQUENCER_ONOFF)
+        return True
+    except nncam.HRESULTException:
+        return False
+
+
+def compile_programs(steps: list, start: int = 0) -> list:
+    """
+    Flattens the compiled macro 'steps' (MacroStep) into one entry per capture, (step index, capture index,
+    exposure in us, gain), skipping the first 'start' captures, and splits them into
+    programs of at most SEQUENCER_MAX_STEPS groups: one trigger per group, so each program
+    runs as a single Trigger(n) at sensor speed.
+    """
+    entries = []
+    for stepIndex, step in enumerate(steps):
+        for captureIndex in range(step.captures):
+            entries.append((stepIndex, captureIndex, step.exposure, step.gain))
+    entries = entries[start:]
+    return [entries[i:i + SEQUENCER_MAX_STEPS] for i in range(0, len(entries), SEQUENCER_MAX_STEPS)]
+
+
+def rounded_settings(hcam, program: list) -> list:
+    """
+    Returns 'program' with the exposure and gain of every group replaced by the values the
+    camera actually applies (exposures are rounded to whole lines), so the frames can be
+    matched on their metadata. Each distinct value is set and read back once, before the
+    sequencer is enabled.
+    """
+    exposures, gains = {}, {}
+    for _, _, exposure, gain in program:
+        if exposure not in exposures:
+            hcam.put_ExpoTime(exposure)
+            exposures[exposure] = hcam.get_ExpoTime()
+        if gain not in gains:
+            hcam.put_ExpoAGain(gain)
+            gains[gain] = hcam.get_ExpoAGain()
+    return [(step, capture, exposures[exposure], gains[gain]) for step, capture, exposure, gain in program]
+
+
+def load_program(hcam, program: list):
+    """
+    Writes the exposure/gain groups of 'program' to the camera and enables the sequencer
+    in software trigger mode; hcam.Trigger(len(program)) then runs it.
+    """
+    hcam.put_Option(nncam.NNCAM_OPTION_SEQUENCER_ONOFF, 0)
+    hcam.put_Option(nncam.NNCAM_OPTION_SEQUENCER_NUMBER, len(program))
+    for i, (_, _, exposure, gain) in enumerate(program, SEQUENCER_FIRST_INDEX):
+        hcam.put_Option(nncam.NNCAM_OPTION_SEQUENCER_EXPOTIME | i, exposure)
+        hcam.put_Option(nncam.NNCAM_OPTION_SEQUENCER_EXPOGAIN | i, gain)
+    hcam.put_Option(nncam.NNCAM_OPTION_TRIGGER, 1)
+    hcam.put_Option(nncam.NNCAM_OPTION_SEQUENCER_ONOFF, 1)
+
+
+def unload_program(hcam):
+    """
+    Cancels pending triggers, disables the sequencer and returns the camera to video mode.
+    """
+    try:
+        hcam.Trigger(0)
+        hcam.put_Option(nncam.NNCAM_OPTION_SEQUENCER_ONOFF, 0)
+        hcam.put_Option(nncam.NNCAM_OPTION_TRIGGER, 0)
+    except nncam.HRESULTException as e:
+        logging.warning("Error restoring the camera after a sequencer run: 0x%08x", e.hr & 0xffffffff)
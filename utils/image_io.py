@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+from utils.decimate import decimation_factor, decimate, DECIMATE_BIN
+from utils.fits_writer import FitsWriter
+from utils.frame_stats import frame_stats, stats_cards
+
+# Shared by the disk writer threads (header templates are cached, encode buffers are per thread)
+_fits_writer = FitsWriter()
+
+
+def write_fits(path: str, data: np.ndarray, cards: dict, bitdepth: int = 16, histogram=None):
+    """
+    Writes 'data' as a FITS file. 'cards' maps keywords to values or (value, comment)
+    tuples; the data statistics (DATAMEAN, DATAMED, ...) are added here, off the GUI thread,
+    from 'histogram': an exact Histogram of the same frame, or a callable returning one
+    (Frame.exactHistogram, shared with the live display).
+    """
+    if callable(histogram):
+        histogram = histogram()
+    hdr = dict(cards)
+    hdr.update(stats_cards(frame_stats(data, bitdepth, histogram)))
+    _fits_writer.write(path, data, hdr)
+
+
+def write_fits_compressed(path: str, data: np.ndarray, cards: dict, bitdepth: int, pool, compression: str):
+    """
+    Writes 'data' as a tile-compressed FITS file ('compression' is RICE_1, GZIP_1 or GZIP_2)
+    through the CompressionPool 'pool', waiting for the worker process to finish.
+    """
+    pool.write(path, data, cards, bitdepth, compression)
+
+
+def write_slotted_frame(path: str, data: np.ndarray, output, slot: int, row: dict):
+    """
+    Writes 'data' and its metadata 'row' to the reserved 'slot' of a multi-frame output
+    (FitsCube, Hdf5Archive) whose file is 'path'.
+    """
+    output.append(data, slot, row)
+
+
+def write_quicklook(path: str, data: np.ndarray, quality: int = -1, thumbnail: int = 0):
+    """
+    Saves 8-bit grayscale 'data' with QImage; the format (JPEG, PNG, ...) is taken from the
+    file extension and 'quality' is 0..100 (-1: Qt default). With 'thumbnail' > 0 a copy
+    reduced to fit 'thumbnail' pixels is also saved as '<name>_thumb.<ext>'.
+    """
+    data = np.ascontiguousarray(data)
+    height, width = data.shape
+    image = QImage(data.data, width, height, data.strides[0], QImage.Format_Grayscale8)
+    if not image.save(path, None, quality):
+        raise IOError(f"Could not save {path}")
+    if thumbnail > 0:
+        # Block-mean downscale in numpy, so the thumbnail costs a fraction of the full encode
+        factor = decimation_factor(width, height, thumbnail, thumbnail)
+        small = np.ascontiguousarray(decimate(data, factor, DECIMATE_BIN))
+        thumb = QImage(small.data, small.shape[1], small.shape[0], small.strides[0], QImage.Format_Grayscale8)
+        base, ext = os.path.splitext(path)
+        thumb.save(f"{base}_thumb{ext}", None, quality)
@@ -0,0 +1,170 @@
+import datetime
+import json
+import logging
+import os
+import threading
+
+from utils import fits_cube, hdf5_archive
+
+JOURNAL_EXT = ".journal"
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+class MacroJournal:
+    """
+    Append-only journal of a macro run, one JSON record per line:
+    - {"type": "plan", "steps": [...]}      the compiled steps, written when the run starts
+    - {"type": "capture", "step": i, "n": n, "file": path, "slot": k, "seq": s, "timestamp": t}
+                                            one per capture once the disk writer has written it
+                                            (slot: index in a FITS cube / HDF5 archive, or -1)
+    - {"type": "resume"} / {"type": "end", "completed": bool}
+    Each record is a single small write flushed to the OS (a crash of the application loses
+    nothing); the file is fsync'ed at step boundaries and at the end. Capture records come
+    from the writer threads (see captureWritten), possibly after the end record.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+        if self._file.tell() and not _ends_with_newline(path):
+            # Terminate a torn last record so that the next one stays readable
+            self._file.write("\n")
+
+    @classmethod
+    def create(cls, directory: str, plan) -> "MacroJournal":
+        """
+        Starts the journal of a new run of 'plan' in 'directory'.
+        """
+        os.makedirs(directory or ".", exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        journal = cls(os.path.join(directory or ".", f"macro_{stamp}{JOURNAL_EXT}"))
+        journal._append({
+            "type": "plan",
+            "time": datetime.datetime.now().isoformat(),
+            "steps": [{"captures": s.captures, "exposure": s.exposure, "gain": s.gain,
+                       "prefix": s.prefix, "directory": s.directory} for s in plan.steps],
+        })
+        journal.sync()
+        return journal
+
+    def _append(self, record: dict):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            try:
+                if self._file.closed:
+                    # A write completed after the end of the run
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(line)
+                    return
+                self._file.write(line)
+                self._file.flush()
+            except (OSError, ValueError) as e:
+                logging.error("Cannot write the macro journal %s: %s", self.path, e)
+
+    def resumed(self):
+        self._append({"type": "resume", "time": datetime.datetime.now().isoformat()})
+
+    def captureWritten(self, step: int, n: int, frame):
+        """
+        Returns the WriteJob completion callback (onWritten) that records capture number 'n'
+        of step 'step' (index in the original plan) once 'frame' is on disk.
+        """
+        seq, timestamp = frame.seq, frame.timestamp
+
+        def written(job):
+            self._append({"type": "capture", "step": step, "n": n, "file": job.path,
+                          "slot": job.kwargs.get("slot", -1), "seq": seq, "timestamp": timestamp})
+        return written
+
+    def end(self, completed: bool):
+        self._append({"type": "end", "completed": completed, "time": datetime.datetime.now().isoformat()})
+        self.close()
+
+    def sync(self):
+        """
+        Forces the journal to disk (survives a power loss up to this point).
+        """
+        with self._lock:
+            try:
+                os.fsync(self._file.fileno())
+            except (OSError, ValueError):
+                pass
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            self._file.close()
+
+
+def _finalized_seqs(path: str):
+    try:
+        if path.endswith(".h5"):
+            return hdf5_archive.finalized_seqs(path)
+        return fits_cube.finalized_seqs(path)
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning("Cannot read %s: %s", path, e)
+        return None
+
+
+class JournalState:
+    """
+    What a journal says about its run: the compiled 'steps' (dicts), the number of captures
+    of every step that are safely on disk ('done'), the last capture number used ('saved')
+    and whether the run completed.
+    A capture is done if its own file still exists or, in a FITS cube / HDF5 archive, if the
+    file was finalized with the capture's frame in its slot; frames of a cube or archive
+    left open by a crash are taken again.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.steps = []
+        self.done = {}
+        self.saved = 0
+        self.missing = 0
+        self.completed = False
+        self._load()
+
+    def _load(self):
+        exists = {}
+        slots = {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash
+                    continue
+                kind = record.get("type")
+                if kind == "plan":
+                    self.steps = record["steps"]
+                elif kind == "capture":
+                    path = record["file"]
+                    if path not in exists:
+                        exists[path] = os.path.exists(path)
+                    self.saved = max(self.saved, record["n"])
+                    slot = record.get("slot", -1)
+                    if slot >= 0 and exists[path]:
+                        if path not in slots:
+                            slots[path] = _finalized_seqs(path)
+                        seqs = slots[path]
+                        written = seqs is not None and slot < len(seqs) and seqs[slot] == record["seq"]
+                    else:
+                        written = exists[path]
+                    if written:
+                        self.done[record["step"]] = self.done.get(record["step"], 0) + 1
+                    else:
+                        self.missing += 1
+                elif kind == "end":
+                    self.completed = record.get("completed", False)
+                elif kind == "resume":
+                    self.completed = False
+        if not self.steps:
+            raise ValueError(f"{self.path} is not a macro journal")
+
+    def remaining(self) -> int:
+        return sum(max(0, step["captures"] - self.done.get(i, 0)) for i, step in enumerate(self.steps))
@@ -0,0 +1,176 @@
+import datetime
+import math
+import os
+import shutil
+
+from utils.bitpack import packed_size
+from utils.fits_writer import FITS_BLOCK
+from utils.raw_container import INDEX_DTYPE
+
+# Bytes per pixel of 8-bit quick-looks of noise-dominated frames (the worst case)
+QUICKLOOK_BYTES_PER_PIXEL = {"jpg": 0.8, "png": 1.1}
+# Per-frame overhead (readout, commanding) assumed until a macro step has been measured
+DEFAULT_OVERHEAD = 0.05
+# Free space to keep on a volume after the plan, as a fraction of its size
+DISK_RESERVE = 0.02
+
+
+def frame_bytes(width: int, height: int, bitdepth: int, formats: dict) -> int:
+    """
+    Estimates the bytes written per capture for the 'formats' selected in the Save options:
+    'fits' (a FITS file, cube slice or archive frame; 'fitsRatio' is the expected compression
+    ratio, 1 = uncompressed), 'raw' (bit-packed at 'packBits' when set) and 'quicklook'
+    ("jpg", "png" or None).
+    """
+    pixels = width * height
+    itemsize = 2 if bitdepth > 8 else 1
+    total = 0
+    if formats.get("fits"):
+        data = pixels * itemsize / formats.get("fitsRatio", 1.0)
+        total += 2 * FITS_BLOCK + math.ceil(data / FITS_BLOCK) * FITS_BLOCK
+    if formats.get("raw"):
+        packBits = formats.get("packBits")
+        total += (packed_size(pixels, packBits) if packBits else pixels * itemsize) + INDEX_DTYPE.itemsize
+    if formats.get("quicklook"):
+        total += pixels * QUICKLOOK_BYTES_PER_PIXEL.get(formats["quicklook"], 1.0)
+    return int(total)
+
+
+def format_bytes(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1000:
+            return f"{n:.1f} {unit}"
+        n /= 1000
+    return f"{n:.1f} TB"
+
+
+def _existing_parent(path: str) -> str:
+    # Step directories are created on the first save; measure the volume they will be on
+    path = os.path.abspath(path or ".")
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+class MacroStep:
+    """
+    One compiled macro step: the table row with its defaults resolved, plus the estimated
+    bytes written and duration.
+    """
+    def __init__(self, index: int, captures: int, exposure: int, gain: int, prefix: str, directory: str):
+        self.index = index
+        self.captures = captures
+        self.exposure = exposure
+        self.gain = gain
+        self.prefix = prefix
+        self.directory = directory
+        # Set on steps continued from a journal (some captures are already on disk)
+        self.resumed = False
+        self.frameTime = 0.0
+        self.bytes = 0
+        self.duration = 0.0
+
+
+class MacroPlan:
+    """
+    A macro compiled before it starts: MacroStep objects (what the sequencer executes) and
+    the estimates used for the preflight checks:
+    - bytes per step and in total, from the frame geometry and the selected formats
+    - duration: per capture, exposure + the measured per-frame 'overhead' (readout,
+      commanding), or the time needed to write the frame at the measured 'writeRate'
+      (bytes/s) when the disk is the bottleneck
+    - free space on the volume of every step directory (shutil.disk_usage)
+    """
+    def __init__(self, steps: list, width: int, height: int, bitdepth: int, formats: dict,
+                 overhead: float = None, writeRate: float = None, defaultDirectory: str = "."):
+        self.width = width
+        self.height = height
+        self.bitdepth = bitdepth
+        self.formats = formats
+        self.overhead = DEFAULT_OVERHEAD if overhead is None else overhead
+        self.overheadMeasured = overhead is not None
+        self.writeRate = writeRate
+        self.bytesPerFrame = frame_bytes(width, height, bitdepth, formats)
+        self.steps = []
+        for index, step in enumerate(steps):
+            compiled = MacroStep(index, max(1, int(step.get("captures", 1))), int(step.get("exposure", 1000)),
+                                 int(step.get("gain", 100)), step.get("prefix", "macro_"),
+                                 step.get("directory") or defaultDirectory)
+            compiled.frameTime = compiled.exposure / 1e6 + self.overhead
+            if writeRate:
+                compiled.frameTime = max(compiled.frameTime, self.bytesPerFrame / writeRate)
+            self.steps.append(compiled)
+        self._estimate()
+
+    def _estimate(self):
+        for step in self.steps:
+            step.bytes = step.captures * self.bytesPerFrame
+            step.duration = step.captures * step.frameTime
+
+    def skip(self, done: dict):
+        """
+        Removes the captures already done ('done': step index -> count, e.g. from a macro
+        journal) and the steps left empty; step indices keep referring to the original plan.
+        """
+        for step in self.steps:
+            count = done.get(step.index, 0)
+            if count:
+                step.captures -= min(count, step.captures)
+                step.resumed = True
+        self.steps = [step for step in self.steps if step.captures > 0]
+        self._estimate()
+
+    @property
+    def captures(self) -> int:
+        return sum(step.captures for step in self.steps)
+
+    @property
+    def bytes(self) -> int:
+        return sum(step.bytes for step in self.steps)
+
+    @property
+    def duration(self) -> float:
+        return sum(step.duration for step in self.steps)
+
+    def diskUsage(self) -> list:
+        """
+        Returns (path, bytes needed, bytes free, volume size) for every volume the plan
+        writes to.
+        """
+        volumes = {}
+        for step in self.steps:
+            path = _existing_parent(step.directory)
+            device = os.stat(path).st_dev
+            if device not in volumes:
+                usage = shutil.disk_usage(path)
+                volumes[device] = [path, 0, usage.free, usage.total]
+            volumes[device][1] += step.bytes
+        return [tuple(v) for v in volumes.values()]
+
+    def preflight(self):
+        """
+        Returns (errors, warnings): errors when a volume cannot hold its share of the plan,
+        warnings when less than DISK_RESERVE of the volume would remain free.
+        """
+        errors, warnings = [], []
+        for path, needed, free, total in self.diskUsage():
+            if needed > free:
+                errors.append(f"{path}: the macro needs {format_bytes(needed)} but only "
+                              f"{format_bytes(free)} are free")
+            elif free - needed < total * DISK_RESERVE:
+                warnings.append(f"{path}: only {format_bytes(free - needed)} would remain free after the macro")
+        return errors, warnings
+
+    def summary(self) -> str:
+        lines = [f"Macro plan: {len(self.steps)} steps, {self.captures} captures, "
+                 f"{format_bytes(self.bytes)} ({format_bytes(self.bytesPerFrame)}/frame), "
+                 f"about {datetime.timedelta(seconds=round(self.duration))} "
+                 f"({'measured' if self.overheadMeasured else 'assumed'} overhead "
+                 f"{self.overhead * 1000:.0f} ms/frame)"]
+        for step in self.steps:
+            lines.append(f"  step {step.index + 1}: {step.captures} x {step.exposure / 1000:g} ms, "
+                         f"{format_bytes(step.bytes)}, {datetime.timedelta(seconds=round(step.duration))}")
+        return "\n".join(lines)
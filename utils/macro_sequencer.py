@@ -0,0 +1,443 @@
+import logging
+import time
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from utils.burst import BURST_STILL, BURST_VIDEO, burst_mode, end_burst, start_burst
+from utils.hw_sequencer import compile_programs, load_program, rounded_settings, sequencer_supported, unload_program
+from utils.utils import log_exceptions
+
+STATE_IDLE = "idle"
+STATE_ARMED = "armed"
+STATE_PROGRAM = "program"
+
+
+class StepStats:
+    """
+    Timing of the macro step being captured: frames received and the time spent in each
+    stage of the capture loop (s); 'busyTime' is the disk writer busy time at the start.
+    """
+    def __init__(self, exposure: int, busyTime: float):
+        self.start = time.perf_counter()
+        self.exposure = exposure
+        self.busyTime = busyTime
+        self.frames = 0
+        self.wait = 0.0
+        self.arm = 0.0
+        self.save = 0.0
+
+
+class MacroSequencer(QObject):
+    """
+    Runs a compiled macro (a MacroPlan, see utils/macro_plan.py) as a
+    small state machine driven by the frames published by the acquisition worker, instead
+    of fixed delays:
+    - idle:  nothing running
+    - armed: the step settings are applied and all captures of the step requested with a
+             single command (SnapN on still-capable cameras, Trigger(n) in software trigger
+             mode, see utils/burst.py); the sequencer waits for the frame of each capture
+    - program: the camera's hardware sequencer runs up to SEQUENCER_MAX_STEPS captures
+             (exposure/gain per group, see utils/hw_sequencer.py) from a single Trigger(n),
+             with no round-trip between frames; the frames are taken in order
+    A capture completes on the first frame that belongs to it: the next still image, or the
+    next live frame exposed with the step's exposure time and gain.
+    The capture loop is pipelined: the frame is held in its pool buffer (a reference), the
+    next capture is armed first (next step configured on the camera, if any) and only then
+    is the frame handed to the save stage, which just queues the writes (DiskWriter,
+    QuickLookEncoder) and the journal record; the preview scheduler renders on its own.
+    The frame-to-frame overhead is then the readout time. If no frame arrives within a timeout derived from the
+    exposure, the rest of the step is requested again (once) or the capture is skipped; a hardware program that
+    stalls is abandoned and the macro continues in software from the missing capture.
+    With 'useHardware' the hardware sequencer is used when the camera supports it.
+    Per-step timing is logged: wall time, exposure and the overhead per frame on top of it,
+    and the time per frame of each stage (waiting for the frame, arming, queuing the save,
+    writing in the disk writer threads); stages adding up to more than the wall time overlapped.
+    With a 'journal' (MacroJournal) every saved capture is recorded, so an interrupted run
+    can be resumed from a plan with the captures on disk skipped (MacroPlan.skip).
+    """
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(int)
+
+    # Timeout = previous exposure + TIMEOUT_FACTOR * exposure + TIMEOUT_MARGIN_MS
+    TIMEOUT_FACTOR = 2
+    TIMEOUT_MARGIN_MS = 1000
+    MAX_RETRIES = 1
+    # Relative tolerance between the requested and the reported exposure time / gain of a frame
+    EXPOSURE_TOLERANCE = 0.02
+    GAIN_TOLERANCE = 0.02
+
+    def __init__(self, controlTab, parent=None):
+        super().__init__(parent)
+        self.controlTab = controlTab
+        self.state = STATE_IDLE
+        self.plan = None
+        self.journal = None
+        self.steps = []
+        # Measured per-frame overhead (s) of the last multi-frame step, for MacroPlan estimates
+        self.lastOverhead = None
+        self.stepIndex = 0
+        self.captureIndex = 0
+        self.completed = 0
+        self.total = 0
+        self.saved = 0
+        self.retries = 0
+        self._exposure = 0
+        self._gain = 0
+        self._previousExposure = 0
+        self._armedTime = 0.0
+        self._stats = None
+        # Steps whose FITS cube / RAW container is open (the save stage may lag behind the armed step)
+        self._cubeStep = None
+        self._rawStep = None
+        self.useHardware = True
+        self._burstMode = None
+        self._programs = []
+        self._program = None
+        self._programPos = 0
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._onTimeout)
+        controlTab.frameReceived.connect(self._onFrame)
+
+    def isRunning(self) -> bool:
+        return self.state != STATE_IDLE
+
+    def start(self, plan, journal=None, firstSaved: int = 0):
+        """
+        Starts the compiled macro 'plan' (aborting a running one), recording its captures in
+        'journal'; file numbers continue after 'firstSaved' when resuming.
+        """
+        self.stop()
+        self.plan = plan
+        self.journal = journal
+        self.steps = steps = plan.steps
+        self.stepIndex = 0
+        self.captureIndex = 0
+        self.completed = 0
+        self.saved = firstSaved
+        self.retries = 0
+        self.total = plan.captures
+        self._previousExposure = 0
+        self._cubeStep = None
+        self._rawStep = None
+        logging.info("Starting Macro: %d steps, %d total captures", len(steps), self.total)
+        self.controlTab.macroActive = True
+        if self.useHardware and self.controlTab.hcam and sequencer_supported(self.controlTab.hcam):
+            self._programs = compile_programs(steps)
+            logging.info("Macro runs on the camera sequencer: %d program(s)", len(self._programs))
+            self._startProgram()
+        else:
+            self._nextCapture()
+
+    def stop(self):
+        """
+        Aborts the running macro; frames already queued are still written.
+        """
+        if self.state == STATE_IDLE:
+            return
+        logging.warning("Macro aborted at step %d, capture %d", self.stepIndex + 1, self.captureIndex + 1)
+        self._finish()
+
+    def currentStep(self) -> dict:
+        return self.steps[self.stepIndex]
+
+    def _nextCapture(self, configure: bool = False):
+        """
+        Applies the step settings on its first capture (or when 'configure' is set), then
+        arms the capture.
+        """
+        if self.stepIndex >= len(self.steps):
+            self._finish()
+            return
+        if not self.controlTab.hcam:
+            logging.error("Camera closed, stopping the Macro.")
+            self._finish()
+            return
+        if configure or self.captureIndex == 0:
+            if not self._configureStep():
+                self._finish()
+                return
+            if self.captureIndex == 0:
+                self._beginStep()
+            self._startBurst()
+        self._arm()
+
+    def _configureStep(self) -> bool:
+        """
+        Applies exposure and gain of the current step to the camera.
+        """
+        step = self.currentStep()
+        control = self.controlTab
+        # Automatic exposure would override the step settings
+        control.cbox_auto.setChecked(False)
+        try:
+            control.hcam.put_ExpoTime(step.exposure)
+            control.hcam.put_ExpoAGain(step.gain)
+            # The camera rounds the exposure to whole lines; match frames on the real values
+            self._exposure = control.hcam.get_ExpoTime()
+            self._gain = control.hcam.get_ExpoAGain()
+        except Exception as e:
+            logging.exception("Error configuring camera in Macro: %s", e)
+            return False
+        return True
+
+    def _beginStep(self):
+        """
+        Shows the settings of the current step and starts its timing.
+        """
+        step = self.currentStep()
+        control = self.controlTab
+        # The camera is already configured (or runs a sequencer program): display only
+        for widget, value in ((control.spin_expoTime, step.exposure), (control.spin_expoGain, step.gain)):
+            widget.blockSignals(True)
+            widget.setValue(value)
+            widget.blockSignals(False)
+        control.le_file_prefix.setText(step.prefix)
+        control.manual_exposure = step.exposure
+        control.manual_gain = step.gain
+        self._stats = StepStats(self._exposure, control.diskWriter.busyTime)
+        logging.info("Macro step %d/%d: %d captures, Expo=%d us, Gain=%d, Prefix=%s, Dir=%s",
+                     step.index + 1, len(self.steps), step.captures, self._exposure, step.gain, step.prefix,
+                     step.directory)
+
+    def _startBurst(self):
+        """
+        Requests the remaining captures of the current step with a single command.
+        """
+        control = self.controlTab
+        self._endBurst()
+        self._burstMode = burst_mode(control.cur.model) if control.cur else BURST_VIDEO
+        try:
+            start_burst(control.hcam, self._burstMode, control.res,
+                        self.currentStep().captures - self.captureIndex)
+        except Exception as e:
+            logging.exception("Error starting the capture burst: %s", e)
+
+    def _endBurst(self):
+        if self._burstMode is not None and self.controlTab.hcam:
+            end_burst(self.controlTab.hcam, self._burstMode)
+        self._burstMode = None
+
+    def _arm(self):
+        """
+        Waits for the frame of the current capture.
+        """
+        self.state = STATE_ARMED
+        self._armedTime = time.perf_counter()
+        timeout = (self._previousExposure + self.TIMEOUT_FACTOR * self._exposure) // 1000 + self.TIMEOUT_MARGIN_MS
+        self._timer.start(int(timeout))
+
+    def _startProgram(self):
+        """
+        Loads the next sequencer program into the camera and triggers all its captures.
+        """
+        if not self._programs:
+            self._finish()
+            return
+        self._program = self._programs.pop(0)
+        self._programPos = 0
+        try:
+            # Frames report the rounded exposure/gain; match them on those
+            self._program = rounded_settings(self.controlTab.hcam, self._program)
+            load_program(self.controlTab.hcam, self._program)
+            self.controlTab.hcam.Trigger(len(self._program))
+        except Exception as e:
+            logging.warning("Camera sequencer failed (%s), continuing in software", e)
+            self._leaveProgram()
+            return
+        self.state = STATE_PROGRAM
+        self._armProgramFrame()
+
+    def _armProgramFrame(self):
+        stepIndex, captureIndex, exposure, gain = self._program[self._programPos]
+        self.stepIndex, self.captureIndex = stepIndex, captureIndex
+        self._exposure = exposure
+        self._gain = gain
+        if captureIndex == 0:
+            self._beginStep()
+        self._armedTime = time.perf_counter()
+        self._timer.start(int(self.TIMEOUT_FACTOR * exposure // 1000 + self.TIMEOUT_MARGIN_MS))
+
+    def _leaveProgram(self):
+        """
+        Stops the hardware sequencer and continues the remaining captures in software.
+        """
+        unload_program(self.controlTab.hcam)
+        self._program = None
+        self._programs = []
+        self.state = STATE_IDLE
+        self._nextCapture(configure=True)
+
+    def _settingsMatch(self, frame) -> bool:
+        return (abs(frame.expotime - self._exposure) <= max(1, self._exposure * self.EXPOSURE_TOLERANCE)
+                and abs(frame.expogain - self._gain) <= max(1, self._gain * self.GAIN_TOLERANCE))
+
+    def _belongsToCapture(self, frame) -> bool:
+        if self._burstMode == BURST_STILL:
+            return frame.still
+        # A live frame exposed with the previous settings (exposure or, in a gain ladder,
+        # gain) is still in flight after a change
+        return not frame.still and self._settingsMatch(frame)
+
+    @log_exceptions
+    def _onFrame(self, frame):
+        if self.state == STATE_IDLE or not self._belongsToCapture(frame):
+            return
+        self._timer.stop()
+        wait = time.perf_counter() - self._armedTime
+        logging.debug("Macro capture %d: frame after %.1f ms", self.completed + 1, wait * 1000)
+        self._stats.frames += 1
+        self._stats.wait += wait
+        self.retries = 0
+        # The reference keeps the buffer out of the frame pool until the save stage is done
+        frame.retain()
+        try:
+            self._advance(frame)
+        finally:
+            frame.release()
+
+    @log_exceptions
+    def _onTimeout(self):
+        if self.state == STATE_PROGRAM:
+            logging.warning("Camera sequencer stalled at step %d, capture %d; continuing in software",
+                            self.stepIndex + 1, self.captureIndex + 1)
+            self._leaveProgram()
+            return
+        if self.state != STATE_ARMED:
+            return
+        if self._burstMode != BURST_VIDEO and self.retries < self.MAX_RETRIES:
+            self.retries += 1
+            logging.warning("No frame within the timeout, requesting the rest of the step again (retry %d)",
+                            self.retries)
+            self._startBurst()
+            self._arm()
+            return
+        logging.error("No frame within the timeout, skipping this capture.")
+        self.retries = 0
+        self._advance()
+
+    def _save(self, frame, step, captureIndex: int, exposure: int, gain: int):
+        """
+        Save stage: queues the frame of capture 'captureIndex' of 'step' as FITS in the step
+        directory (in the step's cube when FITS cubes are enabled), plus the RAW and
+        quick-look copies selected in the Save options, and journals it.
+        Names, directory and the 'exposure'/'gain' header fallback come from the arguments,
+        captured before the next capture was armed: the widgets already show the next step.
+        """
+        self.saved += 1
+        control = self.controlTab
+        control.count += 1
+        # One cube per macro step; a resumed step gets a second cube for the rest
+        name = f"{step.prefix}step{step.index + 1}"
+        if step.resumed:
+            name += f"_from{self.saved}"
+        if control.cbox_fits_cube.isChecked() and self._cubeStep is not step:
+            control.beginFitsCube(control.outputPath(f"{name}.fits", step.directory), step.captures)
+            self._cubeStep = step
+        # Journaled by the disk writer once the frame is written, not when it is queued
+        onWritten = self.journal.captureWritten(step.index, self.saved, frame) if self.journal else None
+        control.saveFitsImage(frame, f"{step.prefix}{self.saved}.fits", step.directory, exposure, gain, onWritten)
+        if control.cbox_save_raw.isChecked():
+            if self._rawStep is not step:
+                # One RAW container per macro step, in the step directory
+                control.beginRawContainer(control.outputPath(f"{name}.praw", step.directory), step.captures)
+                self._rawStep = step
+            control.saveRAWImage(frame)
+        if control.cbox_save_jpeg.isChecked():
+            control.saveQuickLookImage(frame, f"{step.prefix}{self.saved}", step.directory)
+        if captureIndex == step.captures - 1:
+            self._closeCube()
+
+    def _closeCube(self):
+        """
+        Closes the FITS cube and RAW container of the step being saved.
+        """
+        self.controlTab.closeFitsCube()
+        self._cubeStep = None
+        if self._rawStep is not None:
+            self.controlTab.closeRawContainer()
+            self._rawStep = None
+
+    def _advance(self, frame=None):
+        """
+        Completes the current capture: arms the next one, then runs the save stage for
+        'frame' (None for a skipped capture).
+        """
+        # Everything the save stage needs, before arming switches to the next capture
+        step, captureIndex, stats = self.currentStep(), self.captureIndex, self._stats
+        exposure, gain = self._exposure, self._gain
+        stepDone = captureIndex >= step.captures - 1
+        self.completed += 1
+        self._previousExposure = self._exposure
+        if stepDone:
+            self._endBurst()
+            self.captureIndex = 0
+            self.stepIndex += 1
+        else:
+            self.captureIndex += 1
+        t0 = time.perf_counter()
+        if self.completed < self.total:
+            self._armNext()
+        t1 = time.perf_counter()
+        if frame is not None:
+            self._save(frame, step, captureIndex, exposure, gain)
+        elif stepDone and self._cubeStep is step:
+            self._closeCube()
+        if self.state == STATE_IDLE:
+            # The macro ended while arming (camera error): nothing else will be saved
+            self._closeCube()
+        stats.arm += t1 - t0
+        stats.save += time.perf_counter() - t1
+        if stepDone:
+            self._logStep(step, stats)
+            if self.journal:
+                self.journal.sync()
+        self.progress.emit(self.completed)
+        if self.state == STATE_IDLE:
+            # Stopped from a progress slot
+            return
+        if self.completed >= self.total:
+            self._finish()
+
+    def _armNext(self):
+        if self.state != STATE_PROGRAM:
+            self._nextCapture()
+        elif self._programPos + 1 < len(self._program):
+            self._programPos += 1
+            self._armProgramFrame()
+        else:
+            self._startProgram()
+
+    def _logStep(self, step, stats):
+        wall = time.perf_counter() - stats.start
+        frames = stats.frames
+        overhead = wall / frames - stats.exposure / 1e6 if frames else float("nan")
+        if frames > 1:
+            self.lastOverhead = max(0.0, overhead)
+        logging.info("Macro step %d done: %d/%d frames in %.2f s, exposure %.1f ms, overhead %.1f ms/frame",
+                     step.index + 1, frames, step.captures, wall, stats.exposure / 1000, overhead * 1000)
+        if frames:
+            write = self.controlTab.diskWriter.busyTime - stats.busyTime
+            stages = stats.wait + stats.arm + stats.save + write
+            logging.info("Macro step %d stages per frame: wait %.1f ms, arm %.1f ms, save %.1f ms, write %.1f ms "
+                         "(%.0f%% of the wall time%s)", step.index + 1, stats.wait / frames * 1000,
+                         stats.arm / frames * 1000, stats.save / frames * 1000, write / frames * 1000,
+                         stages / wall * 100 if wall > 0 else 0, ", overlapped" if stages > wall else "")
+
+    def _finish(self):
+        if self.state == STATE_IDLE and not self.controlTab.macroActive:
+            return
+        self._timer.stop()
+        if self.state == STATE_PROGRAM and self.controlTab.hcam:
+            unload_program(self.controlTab.hcam)
+        self._endBurst()
+        self._program = None
+        self._programs = []
+        self.state = STATE_IDLE
+        self.controlTab.macroActive = False
+        self._closeCube()
+        if self.journal:
+            self.journal.end(self.completed >= self.total)
+            self.journal = None
+        logging.info("Macro sequence completed (%d captures processed, %d saved).", self.completed, self.saved)
+        self.finished.emit(self.completed)
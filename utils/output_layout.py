@@ -0,0 +1,162 @@
+import datetime
+import logging
+import os
+
+LAYOUT_FLAT = "flat"
+LAYOUT_SESSION = "session"
+LAYOUT_NIGHT = "night"
+
+SHARD_NONE = "none"
+SHARD_FILES = "files"
+SHARD_HOUR = "hour"
+
+INDEX_NAME = "index.csv"
+INDEX_COLUMNS = "FRAME,SEQ,TIMESTAMP,TIME,PATH,SLOT"
+
+
+def _key(directory: str) -> str:
+    # "/data", "/data/" and "data" (from /) are the same directory
+    return os.path.normpath(os.path.abspath(directory))
+
+
+class _Session:
+    """
+    Output state of one root directory: session directory, current shard and index file.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.files = 0
+        self.frames = 0
+        self.lastCapture = None
+        self.index = None
+
+
+class OutputLayout:
+    """
+    Places captures below the root directory chosen in the File Settings:
+    - layout: flat (root itself), one 'session_<start time>' directory per session, or one
+      directory per observing night ('YYYYMMDD' of the evening, the date changes at noon)
+    - sharding: none, a new numbered subdirectory ('0000', '0001', ...) every 'shardFiles'
+      files, or one subdirectory per hour ('YYYYMMDD_HH')
+    Each session directory keeps an append-only 'index.csv' mapping the frame number to the
+    camera sequence number, timestamp and file (plus the slot inside multi-frame files),
+    flushed line by line so it survives a crash. Paths in the index are relative to it.
+    A capture saved in several formats gets one frame number and one row per file.
+    Called from the GUI thread only.
+    """
+    def __init__(self):
+        self.layout = LAYOUT_FLAT
+        self.shard = SHARD_NONE
+        self.shardFiles = 1000
+        self.lastDirectory = None
+        self._sessions = {}
+        self._owners = {}
+
+    def configure(self, layout: str, shard: str, shardFiles: int = None):
+        """
+        Changes the layout; the next file starts a new session.
+        """
+        self.layout = layout
+        self.shard = shard
+        if shardFiles:
+            self.shardFiles = shardFiles
+        self.begin()
+
+    def begin(self):
+        """
+        Ends the current sessions: the next file of every root starts a new session directory
+        (per-night directories and their indexes are simply reopened).
+        """
+        for session in self._sessions.values():
+            if session.index is not None:
+                session.index.close()
+        self._sessions.clear()
+        self._owners.clear()
+
+    def close(self):
+        """
+        Closes the index files.
+        """
+        self.begin()
+
+    def _session(self, root: str, now: datetime.datetime) -> _Session:
+        session = self._sessions.get(_key(root))
+        if session is not None:
+            return session
+        if self.layout == LAYOUT_SESSION:
+            directory = os.path.join(root, now.strftime("session_%Y%m%d_%H%M%S"))
+        elif self.layout == LAYOUT_NIGHT:
+            directory = os.path.join(root, (now - datetime.timedelta(hours=12)).strftime("%Y%m%d"))
+        else:
+            directory = root
+        session = _Session(directory)
+        self._sessions[_key(root)] = session
+        return session
+
+    def directory(self, root: str, now: datetime.datetime = None) -> str:
+        """
+        Returns (creating it if needed) the directory for the next file below 'root'.
+        """
+        now = now or datetime.datetime.now()
+        session = self._session(root or ".", now)
+        if self.shard == SHARD_FILES:
+            directory = os.path.join(session.directory, "%04d" % (session.files // self.shardFiles))
+        elif self.shard == SHARD_HOUR:
+            directory = os.path.join(session.directory, now.strftime("%Y%m%d_%H"))
+        else:
+            directory = session.directory
+        if _key(directory) not in self._owners:
+            os.makedirs(directory, exist_ok=True)
+            self._owners[_key(directory)] = session
+        self.lastDirectory = directory
+        return directory
+
+    def path(self, root: str, name: str) -> str:
+        """
+        Returns the path for a new file 'name' below 'root' and counts it for sharding.
+        """
+        path = os.path.join(self.directory(root), name)
+        self._owners[_key(os.path.dirname(path))].files += 1
+        return path
+
+    def record(self, path: str, frame, slot: int = -1):
+        """
+        Appends the frame saved to 'path' (at 'slot' of a multi-frame file) to the index of
+        the session that handed out the path. Paths not created by path() are not indexed.
+        Consecutive records of the same capture (seq and timestamp) share its frame number.
+        """
+        session = self._owners.get(_key(os.path.dirname(path)))
+        if session is None:
+            return
+        try:
+            if session.index is None:
+                session.index, session.frames = self._openIndex(session.directory)
+            capture = (frame.seq, frame.timestamp)
+            if capture != session.lastCapture:
+                session.frames += 1
+                session.lastCapture = capture
+            relative = os.path.relpath(path, session.directory).replace(os.sep, "/")
+            session.index.write(f"{session.frames},{frame.seq},{frame.timestamp},"
+                                f"{datetime.datetime.now().isoformat()},{relative},{slot}\n")
+            session.index.flush()
+        except OSError as e:
+            logging.error("Cannot update the index of %s: %s", session.directory, e)
+
+    @staticmethod
+    def _openIndex(directory: str):
+        # Frame numbers continue after the last one already in the index
+        path = os.path.join(directory, INDEX_NAME)
+        frames = 0
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                next(f, None)
+                for line in f:
+                    try:
+                        frames = max(frames, int(line.split(",", 1)[0]))
+                    except ValueError:
+                        # A torn last line from a crash
+                        pass
+        index = open(path, "a", encoding="utf-8", newline="\n")
+        if not frames and index.tell() == 0:
+            index.write(INDEX_COLUMNS + "\n")
+        return index, frames
@@ -0,0 +1,48 @@
+import numpy as np
+
+
+class PreviewGeometry:
+    """
+    Geometry of the last rendered preview, cached at render time: where the pixmap sits
+    inside the label and how its pixels map back to raw frame coordinates
+    (decimation factor, decimated size, scaling and flips).
+    """
+    def __init__(self, labelWidth: int, labelHeight: int, pixmapWidth: int, pixmapHeight: int,
+                 decimatedWidth: int, decimatedHeight: int, factor: int,
+                 flipX: bool = False, flipY: bool = False):
+        self.xOffset = (labelWidth - pixmapWidth) // 2
+        self.yOffset = (labelHeight - pixmapHeight) // 2
+        self.pixmapWidth = pixmapWidth
+        self.pixmapHeight = pixmapHeight
+        self.decimatedWidth = decimatedWidth
+        self.decimatedHeight = decimatedHeight
+        self.factor = factor
+        self.flipX = flipX
+        self.flipY = flipY
+
+    def toRaw(self, x: int, y: int):
+        """
+        Maps label coordinates to raw frame coordinates.
+        Returns None if the point is outside the displayed image.
+        """
+        px = x - self.xOffset
+        py = y - self.yOffset
+        if not (0 <= px < self.pixmapWidth and 0 <= py < self.pixmapHeight):
+            return None
+        col = min(self.decimatedWidth - 1, px * self.decimatedWidth // self.pixmapWidth)
+        row = min(self.decimatedHeight - 1, py * self.decimatedHeight // self.pixmapHeight)
+        if self.flipX:
+            col = self.decimatedWidth - 1 - col
+        if self.flipY:
+            row = self.decimatedHeight - 1 - row
+        return col * self.factor, row * self.factor
+
+
+def neighbourhood(data: np.ndarray, x: int, y: int, size: int = 3):
+    """
+    Returns (value, mean, max) for pixel (x, y) and its size x size neighbourhood
+    (clipped at the frame borders).
+    """
+    half = size // 2
+    window = data[max(0, y - half):y + half + 1, max(0, x - half):x + half + 1]
+    return int(data[y, x]), float(window.mean()), int(window.max())
@@ -0,0 +1,101 @@
+import threading
+import time
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+
+class PreviewScheduler(QObject):
+    """
+    Decouples the preview refresh rate from the acquisition rate.
+    Frames are submitted as they arrive; only the newest one is kept and it is
+    emitted through renderFrame at most maxFps times per second, so intermediate
+    frames are skipped without touching the saving path.
+    In adaptive mode the rate drops when rendering takes too long or when the
+    'backlog' callable (0..1, e.g. the disk writer queue fill) reports a backed-up pipeline.
+    """
+    renderFrame = pyqtSignal(object)
+
+    MIN_FPS = 1.0
+    # Fraction of the frame interval that rendering may use before the rate is reduced
+    RENDER_BUDGET = 0.5
+
+    def __init__(self, maxFps: float = 10.0, parent=None):
+        super().__init__(parent)
+        self.maxFps = maxFps
+        self.fps = maxFps
+        self.adaptive = True
+        self.backlog = None
+        self.rendered = 0
+        self.skipped = 0
+        self.lastRenderTime = 0.0
+        self._pending = None
+        self._lock = threading.Lock()
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self._tick)
+
+    def start(self):
+        self._applyInterval()
+        self.timer.start()
+
+    def stop(self):
+        """
+        Stops rendering and drops the pending frame.
+        """
+        self.timer.stop()
+        with self._lock:
+            pending, self._pending = self._pending, None
+        if pending is not None:
+            pending.release()
+
+    def setMaxFps(self, fps: float):
+        self.maxFps = max(self.MIN_FPS, fps)
+        self.fps = self.maxFps
+        self._applyInterval()
+
+    def submit(self, frame):
+        """
+        Offers a frame for preview (takes a reference). A frame that was
+        never rendered is replaced and counted as skipped.
+        """
+        frame.retain()
+        with self._lock:
+            previous, self._pending = self._pending, frame
+        if previous is not None:
+            previous.release()
+            self.skipped += 1
+
+    def _tick(self):
+        with self._lock:
+            frame, self._pending = self._pending, None
+        if frame is None:
+            return
+        t0 = time.perf_counter()
+        try:
+            self.renderFrame.emit(frame)
+        finally:
+            frame.release()
+        self.lastRenderTime = time.perf_counter() - t0
+        self.rendered += 1
+        if self.adaptive:
+            self._adapt()
+
+    def _adapt(self):
+        """
+        Lowers the rate when rendering exceeds its budget or the pipeline is backed up,
+        and slowly recovers towards maxFps otherwise.
+        """
+        interval = 1.0 / self.fps
+        load = self.backlog() if self.backlog is not None else 0.0
+        if load > 0.5:
+            fps = self.fps * 0.5
+        elif self.lastRenderTime > interval * self.RENDER_BUDGET:
+            fps = min(self.fps * 0.8, self.RENDER_BUDGET / self.lastRenderTime)
+        else:
+            fps = self.fps * 1.1
+        fps = min(self.maxFps, max(self.MIN_FPS, fps))
+        if abs(fps - self.fps) > 0.01:
+            self.fps = fps
+            self._applyInterval()
+
+    def _applyInterval(self):
+        self.timer.setInterval(int(1000 / self.fps))
@@ -0,0 +1,110 @@
+import concurrent.futures
+import logging
+import threading
+import time
+
+import numpy as np
+
+from utils.image_io import write_quicklook
+from utils.stretch import PreviewStretcher
+
+QUICKLOOK_FORMATS = ["jpg", "png"]
+
+
+class QuickLookEncoder:
+    """
+    Encodes JPEG/PNG quick-look images in its own thread pool, separate from the disk writer,
+    so science (FITS/RAW) saving never waits on image compression.
+    The worker stretches the frame with the preview stretch settings current at submission
+    (same look as the preview), encodes at 'quality' and optionally writes a 'thumbnail'.
+    Queued quick-looks hold a reference to their pooled frame while the frame pool has more
+    than POOL_RESERVE buffers free, and a private copy of the data otherwise (as the disk
+    writer does). At most 'maxPending' images wait; beyond that new quick-looks are dropped.
+    """
+    # Free pool frames below which queued quick-looks copy the data out of the pool
+    POOL_RESERVE = 2
+
+    def __init__(self, workers: int = 2, maxPending: int = 8):
+        self.quality = 90
+        self.thumbnail = 0
+        self.maxPending = maxPending
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="QuickLook")
+        self._lock = threading.Lock()
+        # The workers share the lookup table cache of one stretcher
+        self._stretcher = PreviewStretcher()
+        self._stretchLock = threading.Lock()
+        self._pending = 0
+        self.encoded = 0
+        self.dropped = 0
+        self.failed = 0
+        self._busy = 0.0
+
+    def submit(self, path: str, frame, mode: str, percentiles) -> bool:
+        """
+        Queues a quick-look of 'frame' stretched with 'mode' and 'percentiles' (see
+        PreviewStretcher). Returns False if it was dropped.
+        """
+        with self._lock:
+            if self._pending >= self.maxPending:
+                self.dropped += 1
+                logging.warning("Quick-look encoder busy, dropped %s", path)
+                return False
+            self._pending += 1
+        if frame.pool is not None and frame.pool.available() < self.POOL_RESERVE:
+            data, held = frame.data.copy(), None
+        else:
+            data, held = frame.data, frame.retain()
+        try:
+            self._executor.submit(self._encode, path, data, frame.bitdepth, held, mode, percentiles,
+                                  self.quality, self.thumbnail)
+        except RuntimeError:
+            # Shut down
+            if held is not None:
+                held.release()
+            with self._lock:
+                self._pending -= 1
+            raise
+        return True
+
+    def _encode(self, path, data, bitdepth, frame, mode, percentiles, quality, thumbnail):
+        t0 = time.perf_counter()
+        try:
+            with self._stretchLock:
+                self._stretcher.mode = mode
+                self._stretcher.percentiles = percentiles
+                lo, hi = self._stretcher.limits(data, bitdepth)
+                lut = self._stretcher.lut(data.dtype, lo, hi)
+            data8 = np.take(lut, data, mode='clip')
+            if frame is not None:
+                frame.release()
+                frame = None
+            write_quicklook(path, data8, quality, thumbnail)
+        except Exception:
+            logging.exception("Error writing quick-look %s", path)
+            with self._lock:
+                self.failed += 1
+        else:
+            with self._lock:
+                self.encoded += 1
+        finally:
+            if frame is not None:
+                frame.release()
+            with self._lock:
+                self._pending -= 1
+                self._busy += time.perf_counter() - t0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "encoded": self.encoded,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "avgMs": self._busy / max(1, self.encoded + self.failed) * 1000,
+            }
+
+    def close(self):
+        """
+        Waits for the queued quick-looks to be written.
+        """
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,176 @@
+import logging
+import math
+import os
+import struct
+
+import numpy as np
+
+from utils.bitpack import PACKABLE_BITS, pack, packed_size, unpack
+from utils.fits_writer import _write_all
+from utils.slotted_output import FRAME_COLUMNS, SlottedOutput, mapped_slots, preallocate
+
+RAW_MAGIC = b"PHSRAW01"
+RAW_VERSION = 1
+# magic, version, width, height, bitdepth, itemsize, packed bits (0: not packed),
+# data offset, frame count, index offset
+RAW_HEADER = struct.Struct("<8sIIIIIIQQQ")
+# Position of the frame count in the header
+RAW_COUNT = struct.Struct("<Q")
+RAW_COUNT_OFFSET = struct.calcsize("<8sIIIIIIQ")
+# Frames start on a page boundary, which keeps memory-mapped frame slices aligned
+RAW_DATA_OFFSET = 4096
+
+INDEX_DTYPE = np.dtype([("OFFSET", "<u8")] + [(name, "<" + npType) for name, npType, _ in FRAME_COLUMNS])
+
+
+class PackedRawWriter(SlottedOutput):
+    """
+    Packed RAW container: a fixed little-endian header, the unpadded frames back-to-back
+    (frame i at RAW_DATA_OFFSET + i * frameBytes, native byte order, 16-bit containers for
+    more than 8 bits) and an index footer with the offset and FRAME_COLUMNS metadata
+    (seq, timestamp, exposure, gain, ...) of every frame.
+    With 'packBits' (10, 12 or 14) 16-bit frames are stored bit-packed (utils/bitpack.py),
+    e.g. 3 bytes per 2 pixels at 12 bits.
+    Frames are written sequentially by slot; with a known 'capacity' the file is preallocated
+    (in PREALLOCATE_CHUNK_BYTES chunks) and the first chunk is filled through an np.memmap.
+    The frame count in the header is kept at the number of leading frames written so far
+    ('committed'), so an unclosed file reads back those frames only (see PackedRawReader);
+    the final count and the index offset are set on close.
+    """
+    def __init__(self, path: str, shape, dtype, bitdepth: int, capacity: int = None, packBits: int = None):
+        super().__init__(path)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.bitdepth = bitdepth
+        if packBits is not None and (packBits not in PACKABLE_BITS or self.dtype != np.uint16):
+            raise ValueError(f"Cannot pack {self.dtype} frames at {packBits} bits")
+        self.packBits = packBits or 0
+        if self.packBits:
+            self.frameBytes = packed_size(math.prod(self.shape), self.packBits)
+        else:
+            self.frameBytes = self.dtype.itemsize * math.prod(self.shape)
+        self.capacity = mapped_slots(capacity, self.frameBytes)
+
+        flags = os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+        self._fd = os.open(path, flags, 0o666)
+        _write_all(self._fd, [self._header(0, 0).ljust(RAW_DATA_OFFSET, b"\0")])
+
+        self._headerCount = 0
+        self._map = None
+        if self.capacity:
+            self._allocated = RAW_DATA_OFFSET + self.capacity * self.frameBytes
+            try:
+                preallocate(self._fd, self._allocated)
+            except OSError:
+                os.close(self._fd)
+                os.remove(path)
+                raise
+            if self.packBits:
+                mapDtype, mapShape = np.uint8, (self.capacity, self.frameBytes)
+            else:
+                mapDtype, mapShape = self.dtype.newbyteorder("<"), (self.capacity,) + self.shape
+            self._map = np.memmap(path, dtype=mapDtype, mode="r+", offset=RAW_DATA_OFFSET, shape=mapShape)
+
+    def _header(self, count: int, indexOffset: int) -> bytes:
+        height, width = self.shape
+        return RAW_HEADER.pack(RAW_MAGIC, RAW_VERSION, width, height, self.bitdepth, self.dtype.itemsize,
+                               self.packBits, RAW_DATA_OFFSET, count, indexOffset)
+
+    def _write(self, data: np.ndarray, slot: int, row: dict):
+        if data.shape != self.shape or data.dtype != self.dtype:
+            raise ValueError(f"Frame {data.shape} {data.dtype} does not match the container "
+                             f"{self.shape} {self.dtype}")
+        if self.packBits:
+            data = pack(data, self.packBits)
+        if slot < self.capacity:
+            # Slots are disjoint, so the mapped copies need no lock
+            self._map[slot] = data
+            with self._lock:
+                self._recordFrame(slot, row)
+                self._writeCount()
+        else:
+            body = np.ascontiguousarray(data, dtype=data.dtype.newbyteorder("<"))
+            with self._lock:
+                self._grow(self._fd, RAW_DATA_OFFSET + (slot + 1) * self.frameBytes)
+                os.lseek(self._fd, RAW_DATA_OFFSET + slot * self.frameBytes, os.SEEK_SET)
+                _write_all(self._fd, [body.reshape(-1).view(np.uint8)])
+                self._recordFrame(slot, row)
+                self._writeCount()
+
+    def _writeCount(self):
+        # Must be called with the lock held (shares the file offset with the write path)
+        if self.committed != self._headerCount:
+            os.lseek(self._fd, RAW_COUNT_OFFSET, os.SEEK_SET)
+            _write_all(self._fd, [RAW_COUNT.pack(self.committed)])
+            self._headerCount = self.committed
+
+    def _finalize(self):
+        fd = self._fd
+        try:
+            if self._map is not None:
+                self._map.flush()
+                self._map = None
+            indexOffset = RAW_DATA_OFFSET + self._length * self.frameBytes
+            table = self.metadataTable()
+            index = np.zeros(self._length, dtype=INDEX_DTYPE)
+            index["OFFSET"] = RAW_DATA_OFFSET + np.arange(self._length, dtype=np.uint64) * self.frameBytes
+            for name in table.dtype.names:
+                index[name] = table[name]
+            os.ftruncate(fd, indexOffset)
+            os.lseek(fd, indexOffset, os.SEEK_SET)
+            _write_all(fd, [index.tobytes()])
+            os.lseek(fd, 0, os.SEEK_SET)
+            _write_all(fd, [self._header(self._length, indexOffset)])
+        finally:
+            self._fd = None
+            os.close(fd)
+        logging.info("RAW container closed: %s (%d frames)", self.path, self.frames)
+
+
+class PackedRawReader:
+    """
+    Reads a packed RAW container: 'frames' is a read-only np.memmap of shape (N, h, w), so
+    frame i is a zero-copy view, and 'index' the per-frame offset/metadata table.
+    Bit-packed containers map the packed bytes instead ('frames' is (N, frameBytes) uint8)
+    and reader[i] unpacks frame i.
+    For a container that was never closed only the frames counted in the header (written
+    before the interruption) are read and 'index' is None.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            fields = RAW_HEADER.unpack(f.read(RAW_HEADER.size))
+        magic, version, width, height, self.bitdepth, itemsize, self.packBits, dataOffset, count, indexOffset = fields
+        if magic != RAW_MAGIC:
+            raise ValueError(f"{path} is not a packed RAW container")
+        if version > RAW_VERSION:
+            raise ValueError(f"{path}: unsupported container version {version}")
+
+        self.dtype = np.dtype("<u1" if itemsize == 1 else "<u2")
+        self.shape = (height, width)
+        if self.packBits:
+            frameBytes = packed_size(width * height, self.packBits)
+            frameShape, mapDtype = (frameBytes,), np.uint8
+        else:
+            frameBytes = width * height * itemsize
+            frameShape, mapDtype = self.shape, self.dtype
+        if indexOffset:
+            self.index = np.fromfile(path, dtype=INDEX_DTYPE, count=count, offset=indexOffset)
+        else:
+            # Preallocated space past the counted frames may never have been written
+            count = min(count, max(0, os.path.getsize(path) - dataOffset) // frameBytes)
+            self.index = None
+        if count:
+            self.frames = np.memmap(path, dtype=mapDtype, mode="r", offset=dataOffset,
+                                    shape=(count,) + frameShape)
+        else:
+            # np.memmap cannot map an empty range
+            self.frames = np.empty((0,) + frameShape, dtype=mapDtype)
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def __getitem__(self, i):
+        if not self.packBits:
+            return self.frames[i]
+        return unpack(self.frames[i], self.packBits, self.shape[0] * self.shape[1]).reshape(self.shape)
@@ -0,0 +1,170 @@
+import errno
+import os
+import threading
+
+import numpy as np
+
+# Per-frame metadata kept by the multi-frame outputs: name, numpy type, unit
+FRAME_COLUMNS = [
+    ("SEQ", "i8", ""),
+    ("TIMESTAMP", "i8", "us"),
+    ("EXPTIME", "f8", "s"),
+    ("GAIN", "i4", "%"),
+    ("BLACKLEVEL", "i4", ""),
+    ("TEMP", "f4", "C"),
+]
+
+
+# Largest preallocation (and memory map) made at once; longer runs grow by this much
+PREALLOCATE_CHUNK_BYTES = 1 << 30
+
+
+def preallocate(fd: int, size: int):
+    """
+    Reserves 'size' bytes for the file: real blocks with posix_fallocate where available
+    (less fragmentation, no ENOSPC halfway through a run), a sparse extension otherwise.
+    Raises OSError(ENOSPC) if the disk cannot hold them, after giving back whatever the
+    failed allocation took.
+    """
+    if hasattr(os, "posix_fallocate"):
+        previous = os.fstat(fd).st_size
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                os.ftruncate(fd, previous)
+                raise
+            # Not supported by the file system: fall back to a sparse file
+    os.ftruncate(fd, size)
+
+
+def mapped_slots(capacity: int, frameBytes: int) -> int:
+    """
+    Returns how many of 'capacity' frames are preallocated and memory mapped up front:
+    at most PREALLOCATE_CHUNK_BYTES worth (at least one frame); later slots go through
+    the regular write path, growing the file chunk by chunk (see SlottedOutput._grow).
+    """
+    if not capacity:
+        return 0
+    return max(1, min(capacity, PREALLOCATE_CHUNK_BYTES // max(1, frameBytes)))
+
+
+class SlottedOutput:
+    """
+    Base class for outputs that collect a sequence of frames in a single file
+    (FITS cube, HDF5 archive, ...) from the disk writer threads.
+    The GUI thread reserve()s a slot per queued frame, in arrival order, and cancel()s it if
+    the job is dropped; writer threads then append() each frame to its slot, so the frame
+    order survives concurrent writers. 'committed' counts the leading slots that are all
+    written (what an interrupted file can be trusted with). After close() the file is
+    finalized by whichever thread completes the last pending append.
+    Subclasses implement _write(data, slot, row) and _finalize().
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.frames = 0
+        self._rows = {}
+        self._nextSlot = 0
+        self._length = 0
+        self.committed = 0
+        self._written = set()
+        self._pending = 0
+        self._closing = False
+        self._finalized = False
+        self._allocated = 0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> int:
+        """
+        Announces a frame that has been queued for append() and returns its slot.
+        """
+        with self._lock:
+            self._pending += 1
+            slot = self._nextSlot
+            self._nextSlot += 1
+            return slot
+
+    def cancel(self, slot: int = None):
+        """
+        Withdraws a reserved frame that will not be appended (e.g. dropped by the writer).
+        The last reserved 'slot' is given back, any other slot is left empty.
+        """
+        with self._lock:
+            if slot is not None and slot == self._nextSlot - 1:
+                self._nextSlot -= 1
+            self._pending -= 1
+            self._finalizeIfDone()
+
+    def append(self, data: np.ndarray, slot: int, row: dict):
+        """
+        Writes one reserved frame into its slot and records its metadata row.
+        """
+        try:
+            if self._finalized:
+                raise ValueError(f"{self.path} is already finalized")
+            self._write(data, slot, row)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._finalizeIfDone()
+
+    def close(self):
+        """
+        Stops accepting frames; the file is finalized once the pending appends are written.
+        """
+        with self._lock:
+            self._closing = True
+            self._finalizeIfDone()
+
+    def _recordFrame(self, slot: int, row: dict):
+        """
+        Books a written frame. Must be called with the lock held.
+        """
+        self.frames += 1
+        self._rows[slot] = row
+        self._length = max(self._length, slot + 1)
+        self._written.add(slot)
+        while self.committed in self._written:
+            self._written.remove(self.committed)
+            self.committed += 1
+
+    def _grow(self, fd: int, end: int):
+        """
+        Makes sure the file is preallocated up to 'end', one PREALLOCATE_CHUNK_BYTES chunk
+        at a time, for files that were preallocated at all. Must be called with the lock held.
+        """
+        if not self._allocated or end <= self._allocated:
+            return
+        size = self._allocated
+        while size < end:
+            size += PREALLOCATE_CHUNK_BYTES
+        preallocate(fd, size)
+        self._allocated = size
+
+    def _finalizeIfDone(self):
+        if not self._closing or self._pending > 0 or self._finalized:
+            return
+        self._finalized = True
+        self._finalize()
+
+    def metadataTable(self) -> np.ndarray:
+        """
+        Returns the FRAME_COLUMNS rows of the first 'length' slots as a structured array.
+        Empty slots (dropped frames) are marked with -1 and NaN.
+        """
+        table = np.zeros(self._length, dtype=[(name, npType) for name, npType, _ in FRAME_COLUMNS])
+        for name, _, _ in FRAME_COLUMNS:
+            table[name] = np.nan if table.dtype[name].kind == 'f' else -1
+        for slot, row in self._rows.items():
+            for name, _, _ in FRAME_COLUMNS:
+                value = row.get(name)
+                if isinstance(value, (int, float, np.number)):
+                    table[name][slot] = value
+        return table
+
+    def _write(self, data: np.ndarray, slot: int, row: dict):
+        raise NotImplementedError
+
+    def _finalize(self):
+        raise NotImplementedError
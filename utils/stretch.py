@@ -0,0 +1,104 @@
+import collections
+
+import numpy as np
+
+STRETCH_LINEAR = "linear"
+STRETCH_MINMAX = "minmax"
+STRETCH_PERCENTILE = "percentile"
+STRETCH_ASINH = "asinh"
+STRETCH_LOG = "log"
+
+STRETCH_MODES = [STRETCH_LINEAR, STRETCH_MINMAX, STRETCH_PERCENTILE, STRETCH_ASINH, STRETCH_LOG]
+
+
+class PreviewStretcher:
+    """
+    Converts 8/16-bit raw frames to 8-bit preview data with a single np.take through a cached
+    lookup table (one entry per possible input value, up to 65536) into a reused uint8 buffer.
+    - linear:     full native range of the bit depth
+    - minmax:     data minimum to maximum
+    - percentile: low/high percentiles of the data
+    - asinh, log: non-linear curves between the percentile limits, to bring out faint targets
+    Data limits are estimated from a strided subsample of the frame and rounded outwards to
+    a grid of 1/32 to 1/64 of their span, so that the lookup table of a steady scene is
+    built once and then reused from the cache instead of being rebuilt on every frame.
+    """
+    # Approximate number of pixels used to estimate the stretch limits
+    SAMPLE_PIXELS = 65536
+    ASINH_SOFTENING = 10.0
+    LOG_SOFTENING = 1000.0
+    # Number of lookup tables kept in the cache
+    CACHE_SIZE = 8
+    # The limits are rounded to a power-of-two step of at most 1/LIMIT_STEPS of their span
+    LIMIT_STEPS = 32
+
+    def __init__(self, mode: str = STRETCH_LINEAR, percentiles=(0.5, 99.5)):
+        self.mode = mode
+        self.percentiles = percentiles
+        self._luts = collections.OrderedDict()
+        self._out = None
+
+    def sample(self, data: np.ndarray) -> np.ndarray:
+        """
+        Returns a strided view of roughly SAMPLE_PIXELS pixels of the frame.
+        """
+        step = max(1, int(np.sqrt(data.size / self.SAMPLE_PIXELS)))
+        return data[::step, ::step]
+
+    def limits(self, data: np.ndarray, bitdepth: int):
+        """
+        Returns the (low, high) input values mapped to 0 and 255 for the current mode.
+        """
+        if self.mode == STRETCH_LINEAR:
+            return 0, 2**bitdepth - 1
+        sample = self.sample(data)
+        if self.mode == STRETCH_MINMAX:
+            lo, hi = int(sample.min()), int(sample.max())
+        else:
+            lo, hi = (int(v) for v in np.percentile(sample, self.percentiles))
+        if hi <= lo:
+            hi = lo + 1
+        return self.quantize(lo, hi)
+
+    def quantize(self, lo: int, hi: int):
+        """
+        Rounds the limits outwards (lo down, hi up) to a power-of-two step of at most
+        1/LIMIT_STEPS of their span.
+        """
+        step = 1 << max(0, ((hi - lo) // self.LIMIT_STEPS).bit_length() - 1)
+        return lo - lo % step, -(-hi // step) * step
+
+    def lut(self, dtype, lo: int, hi: int) -> np.ndarray:
+        """
+        Returns the (cached) uint8 lookup table covering every value of 'dtype'.
+        """
+        key = (np.dtype(dtype).itemsize, self.mode, lo, hi)
+        lut = self._luts.get(key)
+        if lut is not None:
+            self._luts.move_to_end(key)
+            return lut
+
+        x = np.arange(256 if np.dtype(dtype).itemsize == 1 else 65536, dtype=np.float32)
+        t = np.clip((x - lo) / (hi - lo), 0.0, 1.0)
+        if self.mode == STRETCH_ASINH:
+            t = np.arcsinh(self.ASINH_SOFTENING * t) / np.arcsinh(self.ASINH_SOFTENING)
+        elif self.mode == STRETCH_LOG:
+            t = np.log1p(self.LOG_SOFTENING * t) / np.log1p(self.LOG_SOFTENING)
+        lut = (t * 255 + 0.5).astype(np.uint8)
+
+        self._luts[key] = lut
+        if len(self._luts) > self.CACHE_SIZE:
+            self._luts.popitem(last=False)
+        return lut
+
+    def apply(self, data: np.ndarray, bitdepth: int) -> np.ndarray:
+        """
+        Returns the 8-bit preview of 'data'. The result lives in a buffer reused by the
+        next call, so consumers must copy it (e.g. QImage.scaled) before calling again.
+        """
+        lo, hi = self.limits(data, bitdepth)
+        lut = self.lut(data.dtype, lo, hi)
+        if self._out is None or self._out.shape != data.shape:
+            self._out = np.empty(data.shape, dtype=np.uint8)
+        np.take(lut, data, out=self._out, mode='clip')
+        return self._out
@@ -1,8 +1,8 @@
 # control_widget.py
-import ctypes
 import numpy as np
 import datetime
 import logging
+import time
 
 from PyQt5 import QtWidgets, QtGui
 from PyQt5.QtCore import pyqtSignal, QTimer, Qt, QSignalBlocker
@@ -16,24 +16,38 @@ from PyQt5.QtWidgets import (
 
 from qt_material import apply_stylesheet
 import qtawesome as qta
-from astropy.io import fits
-
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 
 import nncam.nncam as nncam
 
 # Import auxiliary classes
 from utils.utils import log_exceptions
+from utils.acquisition import AcquisitionWorker
+from utils.frame_pool import FramePool
+from utils.disk_writer import DiskWriter, WriteJob, POLICY_BLOCK, POLICY_DROP, POLICY_SPILL
+from utils.image_io import write_fits, write_fits_compressed, write_slotted_frame
+from utils.quicklook import QuickLookEncoder, QUICKLOOK_FORMATS
+from utils.output_layout import (OutputLayout, LAYOUT_FLAT, LAYOUT_SESSION, LAYOUT_NIGHT, SHARD_NONE,
+                                  SHARD_FILES, SHARD_HOUR)
+from utils.fits_compress import (CompressionPool, COMPRESSION_NONE, COMPRESSION_RICE, COMPRESSION_GZIP,
+                                  COMPRESSION_GZIP_SHUFFLE)
+from utils.fits_cube import FitsCube
+from utils.hdf5_archive import Hdf5Archive, ARCHIVE_FILTERS, h5py
+from utils.raw_container import PackedRawWriter
+from utils.bitpack import PACKABLE_BITS
+from utils.burst import burst_mode, start_burst, end_burst, BURST_STILL
+from utils.macro_plan import MacroPlan
+from utils.preview_scheduler import PreviewScheduler
+from utils.stretch import PreviewStretcher, STRETCH_MODES
+from utils.decimate import decimation_factor, decimate, DECIMATE_METHODS
+from utils.histogram import HistogramEngine
+from utils.pixel_inspector import PreviewGeometry, neighbourhood
 from widgets.collapsible_box import CollapsibleBox
 from widgets.preview_label import PreviewLabel
 from widgets.preview_window import PreviewWindow
+from widgets.histogram_widget import HistogramWidget
 
 from widgets.circular_progress import CircularProgress
 
-plt.style.use('dark_background')
-
 
 class ControlWidget(QtWidgets.QWidget):
     """
@@ -42,6 +56,17 @@ class ControlWidget(QtWidgets.QWidget):
     file saving, histograms, etc.
     """
     evtCallback = pyqtSignal(int)
+    # Every live or still frame accepted by the widget (used by the macro sequencer)
+    frameReceived = pyqtSignal(object)
+    
+    # Number of preallocated frame buffers shared by the live, save and macro paths
+    FRAME_POOL_SIZE = 8
+    # Maximum number of pending file writes before the back-pressure policy applies
+    WRITER_QUEUE_SIZE = 64
+    # Default maximum preview refresh rate (frames per second)
+    PREVIEW_FPS = 10
+    # Minimum interval between histogram refreshes (seconds)
+    HISTOGRAM_INTERVAL = 0.25
     
     @log_exceptions
     def __init__(self, parent=None):
@@ -54,16 +79,50 @@ class ControlWidget(QtWidgets.QWidget):
         self.timer = QTimer(self)
         self.imgWidth = 0
         self.imgHeight = 0
-        self.pData = None
+        self.acqWorker = None
+        self.framePool = None
+        self.currentFrame = None
+        self.displayedFrame = None
+        self.previewGeometry = None
+        self.frameCounter = 0
         self.res = 0
         self.count = 0
         self.currentPreviewImage = None
         self.bitdepth = 12
         self.save_capture = False
         self.trigger_remaining = 0
+        # Burst in progress: capture mode, length and start time; burstTimer catches stalls
+        self.burstMode = None
+        self.burstTotal = 0
+        self.burstStart = 0.0
+        self.burstTimer = QTimer(self)
+        self.burstTimer.setSingleShot(True)
+        self.burstTimer.timeout.connect(self.onBurstTimeout)
+        # Set while a macro runs: the macro sequencer saves the still images itself
+        self.macroActive = False
+        # FITS cube collecting the current burst/macro step (created on its first frame)
+        self.fitsCubePath = None
+        self.fitsCubeFrames = None
+        self.fitsCube = None
+        # HDF5 archive collecting every FITS save of the session
+        self.sessionArchive = None
+        # Packed RAW container receiving the RAW saves (per burst, or per session otherwise)
+        self.rawContainerPath = None
+        self.rawContainerFrames = None
+        self.rawContainer = None
         self.manual_exposure = None
         self.manual_gain = None
         self.previewWindow = None
+        self.diskWriter = DiskWriter(2, self.WRITER_QUEUE_SIZE, POLICY_BLOCK)
+        self.compressionPool = CompressionPool(self.diskWriter.workers())
+        self.quickLook = QuickLookEncoder()
+        self.outputLayout = OutputLayout()
+        self.previewScheduler = PreviewScheduler(self.PREVIEW_FPS, self)
+        self.previewScheduler.backlog = lambda: self.diskWriter.pending() / self.diskWriter.maxQueue
+        self.previewScheduler.renderFrame.connect(self.renderPreview)
+        self.stretcher = PreviewStretcher()
+        self.histogramEngine = HistogramEngine()
+        self.lastHistogramTime = 0.0
         # Initial text color
         self.text_color = "#FD3A4A"
         
@@ -115,6 +174,22 @@ class ControlWidget(QtWidgets.QWidget):
         self.btn_flipX.clicked.connect(self.toggleFlipX)
         self.btn_flipY.clicked.connect(self.toggleFlipY)
         
+        # Preview stretch (display only, saved data is not affected)
+        self.cmb_stretch = QComboBox()
+        self.cmb_stretch.addItems(STRETCH_MODES)
+        self.cmb_stretch.setCurrentText(self.stretcher.mode)
+        self.cmb_stretch.currentTextChanged.connect(self.onStretchChanged)
+        
+        # Preview downscaling: every n-th pixel (fast) or block mean (smoother)
+        self.cmb_decimation = QComboBox()
+        self.cmb_decimation.addItems(DECIMATE_METHODS)
+        
+        stretchLayout = QHBoxLayout()
+        stretchLayout.addWidget(QLabel("Preview stretch:"))
+        stretchLayout.addWidget(self.cmb_stretch)
+        stretchLayout.addWidget(QLabel("Downscale:"))
+        stretchLayout.addWidget(self.cmb_decimation)
+        
         expLayout = QHBoxLayout()
         expLayout.addWidget(QLabel("Time(us):"))
         expLayout.addWidget(self.spin_expoTime)
@@ -128,6 +203,7 @@ class ControlWidget(QtWidgets.QWidget):
         vlytexp.addWidget(self.lblCameraSpecs)
         vlytexp.addWidget(self.btn_flipX)
         vlytexp.addWidget(self.btn_flipY)
+        vlytexp.addLayout(stretchLayout)
         
         gboxexp.setLayout(vlytexp)
         
@@ -144,19 +220,27 @@ class ControlWidget(QtWidgets.QWidget):
         self.btn_trigger.clicked.connect(self.onBtnTrigger)
         
         # Checkboxes for save formats
-        self.cbox_save_jpeg = QCheckBox("Save JPEG")
+        self.cbox_save_jpeg = QCheckBox("Save quick-look")
         self.cbox_save_jpeg.setChecked(True)
         
         self.cbox_save_raw = QCheckBox("Save RAW")
         self.cbox_save_raw.setChecked(True)
         
+        self.cbox_pack_raw = QCheckBox("Bit-pack RAW")
+        self.cbox_pack_raw.setToolTip("Store 10/12/14-bit RAW pixels without the unused bits "
+                                      "(12-bit: 3 bytes per 2 pixels instead of 4)")
+        
         self.cbox_save_fits = QCheckBox("Save FITS")
         self.cbox_save_fits.setChecked(True)
         
+        self.cbox_fits_cube = QCheckBox("FITS cube")
+        self.cbox_fits_cube.setToolTip("Save trigger bursts and macro steps as one (N, h, w) FITS file each")
+        
         # SpinBox for trigger count
         self.spin_trigger_count = QSpinBox()
         self.spin_trigger_count.setMinimum(1)
-        self.spin_trigger_count.setMaximum(100)
+        # Bursts are requested with a single command, so their length is only bounded by disk
+        self.spin_trigger_count.setMaximum(1000000)
         self.spin_trigger_count.setValue(1)
         
         # Circular progress bar
@@ -182,7 +266,9 @@ class ControlWidget(QtWidgets.QWidget):
         saveOptionsLayout = QHBoxLayout()
         saveOptionsLayout.addWidget(self.cbox_save_jpeg)
         saveOptionsLayout.addWidget(self.cbox_save_raw)
+        saveOptionsLayout.addWidget(self.cbox_pack_raw)
         saveOptionsLayout.addWidget(self.cbox_save_fits)
+        saveOptionsLayout.addWidget(self.cbox_fits_cube)
         
         layout3 = QVBoxLayout()
         layout3.addLayout(layout1)
@@ -214,6 +300,100 @@ class ControlWidget(QtWidgets.QWidget):
         self.btn_openDirectory.setIcon(qta_icon('mdi.folder-open', color='white'))
         self.btn_openDirectory.clicked.connect(self.openLastImagesDirectory)
         
+        # Disk writer: number of writer threads and policy when the queue is full
+        self.spin_writer_threads = QSpinBox()
+        self.spin_writer_threads.setRange(1, 8)
+        self.spin_writer_threads.setValue(self.diskWriter.workers())
+        self.spin_writer_threads.valueChanged.connect(self.onWriterThreadsChanged)
+        
+        self.cmb_writer_policy = QComboBox()
+        self.cmb_writer_policy.addItem("Block", POLICY_BLOCK)
+        self.cmb_writer_policy.addItem("Drop newest", POLICY_DROP)
+        self.cmb_writer_policy.addItem("Spill to disk", POLICY_SPILL)
+        self.cmb_writer_policy.currentIndexChanged.connect(self.onWriterPolicyChanged)
+        
+        # FITS tile compression, done in worker processes (one per writer thread)
+        self.cmb_fits_compression = QComboBox()
+        self.cmb_fits_compression.addItem("None", COMPRESSION_NONE)
+        self.cmb_fits_compression.addItem("Rice", COMPRESSION_RICE)
+        self.cmb_fits_compression.addItem("GZIP", COMPRESSION_GZIP)
+        self.cmb_fits_compression.addItem("GZIP + shuffle", COMPRESSION_GZIP_SHUFFLE)
+        
+        # Session archive: all FITS saves in one HDF5 file (needs h5py)
+        self.cbox_hdf5_archive = QCheckBox("HDF5 session archive")
+        self.cbox_hdf5_archive.toggled.connect(self.onSessionArchiveToggled)
+        self.cmb_archive_filter = QComboBox()
+        for archiveFilter in ARCHIVE_FILTERS:
+            self.cmb_archive_filter.addItem(archiveFilter or "None", archiveFilter)
+        if h5py is None:
+            self.cbox_hdf5_archive.setEnabled(False)
+            self.cbox_hdf5_archive.setToolTip("Install h5py to enable HDF5 archives")
+        
+        # Quick-look images (stretched like the preview), encoded off the disk writer
+        self.cmb_quicklook_format = QComboBox()
+        self.cmb_quicklook_format.addItems(QUICKLOOK_FORMATS)
+        self.spin_quicklook_quality = QSpinBox()
+        self.spin_quicklook_quality.setRange(1, 100)
+        self.spin_quicklook_quality.setValue(self.quickLook.quality)
+        self.spin_quicklook_quality.valueChanged.connect(self.onQuickLookQualityChanged)
+        self.spin_thumbnail = QSpinBox()
+        self.spin_thumbnail.setRange(0, 1024)
+        self.spin_thumbnail.setSingleStep(64)
+        self.spin_thumbnail.setSpecialValueText("Off")
+        self.spin_thumbnail.setValue(self.quickLook.thumbnail)
+        self.spin_thumbnail.valueChanged.connect(self.onThumbnailSizeChanged)
+        
+        quickLookLayout = QHBoxLayout()
+        quickLookLayout.addWidget(QLabel("Quick-look:"))
+        quickLookLayout.addWidget(self.cmb_quicklook_format)
+        quickLookLayout.addWidget(QLabel("Quality:"))
+        quickLookLayout.addWidget(self.spin_quicklook_quality)
+        quickLookLayout.addWidget(QLabel("Thumbnail (px):"))
+        quickLookLayout.addWidget(self.spin_thumbnail)
+        quickLookLayout.addStretch()
+        
+        # Output layout: session/night directories, sharding and the frame index
+        self.cmb_output_layout = QComboBox()
+        self.cmb_output_layout.addItem("Flat", LAYOUT_FLAT)
+        self.cmb_output_layout.addItem("Per session", LAYOUT_SESSION)
+        self.cmb_output_layout.addItem("Per night", LAYOUT_NIGHT)
+        self.cmb_output_shard = QComboBox()
+        self.cmb_output_shard.addItem("None", SHARD_NONE)
+        self.cmb_output_shard.addItem("Every N files", SHARD_FILES)
+        self.cmb_output_shard.addItem("Hourly", SHARD_HOUR)
+        self.spin_shard_files = QSpinBox()
+        self.spin_shard_files.setRange(10, 100000)
+        self.spin_shard_files.setSingleStep(100)
+        self.spin_shard_files.setValue(self.outputLayout.shardFiles)
+        self.spin_shard_files.setEnabled(False)
+        self.cmb_output_layout.currentIndexChanged.connect(self.onOutputLayoutChanged)
+        self.cmb_output_shard.currentIndexChanged.connect(self.onOutputLayoutChanged)
+        self.spin_shard_files.valueChanged.connect(self.onOutputLayoutChanged)
+        
+        outputLayoutRow = QHBoxLayout()
+        outputLayoutRow.addWidget(QLabel("Layout:"))
+        outputLayoutRow.addWidget(self.cmb_output_layout)
+        outputLayoutRow.addWidget(QLabel("Shard:"))
+        outputLayoutRow.addWidget(self.cmb_output_shard)
+        outputLayoutRow.addWidget(self.spin_shard_files)
+        outputLayoutRow.addStretch()
+        
+        archiveLayout = QHBoxLayout()
+        archiveLayout.addWidget(self.cbox_hdf5_archive)
+        archiveLayout.addWidget(QLabel("Filter:"))
+        archiveLayout.addWidget(self.cmb_archive_filter)
+        archiveLayout.addStretch()
+        
+        writerLayout = QHBoxLayout()
+        writerLayout.addWidget(QLabel("Writer threads:"))
+        writerLayout.addWidget(self.spin_writer_threads)
+        writerLayout.addWidget(QLabel("When queue full:"))
+        writerLayout.addWidget(self.cmb_writer_policy)
+        writerLayout.addWidget(QLabel("FITS compression:"))
+        writerLayout.addWidget(self.cmb_fits_compression)
+        
+        self.lbl_writer = QLabel("Writer: idle")
+        
         fileLayout = QVBoxLayout()
         fileLayout.addWidget(lbl_prefix)
         fileLayout.addWidget(self.le_file_prefix)
@@ -222,6 +402,11 @@ class ControlWidget(QtWidgets.QWidget):
         fileLayout.addWidget(self.le_directory)
         fileLayout.addWidget(btn_browse)
         fileLayout.addWidget(self.btn_openDirectory)
+        fileLayout.addLayout(outputLayoutRow)
+        fileLayout.addLayout(writerLayout)
+        fileLayout.addLayout(archiveLayout)
+        fileLayout.addLayout(quickLookLayout)
+        fileLayout.addWidget(self.lbl_writer)
         
         fileBox.addLayout(fileLayout)
         
@@ -255,9 +440,6 @@ class ControlWidget(QtWidgets.QWidget):
         wgctrl.setLayout(leftLayout)
         
         # Right panel (Preview and Histograms/Macro)
-        from matplotlib.figure import Figure
-        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-        
         self.lbl_video = PreviewLabel(self)
         self.lbl_video.setMinimumSize(640, 480)
         self.lbl_video.mouseMoved.connect(self.updatePixelCount)
@@ -265,16 +447,58 @@ class ControlWidget(QtWidgets.QWidget):
         self.lbl_pixel_info = QLabel("Pixel info:")
         self.btn_openPreview.clicked.connect(self.openPreviewWindow)
         
+        # Preview refresh rate (independent of the acquisition rate)
+        self.spin_preview_fps = QSpinBox()
+        self.spin_preview_fps.setRange(1, 60)
+        self.spin_preview_fps.setValue(self.PREVIEW_FPS)
+        self.spin_preview_fps.valueChanged.connect(self.previewScheduler.setMaxFps)
+        
+        self.cbox_adaptive_preview = QCheckBox("Adaptive")
+        self.cbox_adaptive_preview.setChecked(self.previewScheduler.adaptive)
+        self.cbox_adaptive_preview.toggled.connect(self.onAdaptivePreviewToggled)
+        
+        # Neighbourhood size of the pixel inspector
+        self.spin_inspect_size = QSpinBox()
+        self.spin_inspect_size.setRange(1, 15)
+        self.spin_inspect_size.setSingleStep(2)
+        self.spin_inspect_size.setValue(3)
+        
+        pixelInfoLayout = QHBoxLayout()
+        pixelInfoLayout.addWidget(self.lbl_pixel_info, 1)
+        pixelInfoLayout.addWidget(QLabel("Area (px):"))
+        pixelInfoLayout.addWidget(self.spin_inspect_size)
+        
+        previewLayout = QHBoxLayout()
+        previewLayout.addWidget(self.btn_openPreview)
+        previewLayout.addWidget(QLabel("Preview FPS:"))
+        previewLayout.addWidget(self.spin_preview_fps)
+        previewLayout.addWidget(self.cbox_adaptive_preview)
+        
         # Histogram
-        self.figure = Figure(figsize=(4, 3))
-        self.ax_hist = self.figure.add_subplot(111)
-        self.canvas_hist = FigureCanvas(self.figure)
+        self.histWidget = HistogramWidget()
+        self.cbox_hist_log = QCheckBox("Log scale")
+        self.cbox_hist_log.toggled.connect(self.histWidget.setLogScale)
+        self.cbox_hist_cumulative = QCheckBox("Cumulative")
+        self.cbox_hist_cumulative.toggled.connect(self.histWidget.setCumulative)
+        self.cbox_hist_exact = QCheckBox("Full frame")
+        self.cbox_hist_exact.setToolTip("Count every pixel (exact, also reused for the FITS statistics)")
+        self.cbox_hist_exact.toggled.connect(self.onHistogramExactToggled)
+        self.btn_exportHist = QPushButton("Export...")
+        self.btn_exportHist.clicked.connect(self.onExportHistogram)
+        
+        histOptionsLayout = QHBoxLayout()
+        histOptionsLayout.addWidget(self.cbox_hist_log)
+        histOptionsLayout.addWidget(self.cbox_hist_cumulative)
+        histOptionsLayout.addWidget(self.cbox_hist_exact)
+        histOptionsLayout.addStretch()
+        histOptionsLayout.addWidget(self.btn_exportHist)
         
         # Histogram tab
         from PyQt5.QtWidgets import QWidget, QTabWidget, QScrollArea
         histTab = QWidget()
         histLayout = QVBoxLayout()
-        histLayout.addWidget(self.canvas_hist)
+        histLayout.addWidget(self.histWidget)
+        histLayout.addLayout(histOptionsLayout)
         histTab.setLayout(histLayout)
         
         # Macro tab (loaded from macro_widget.py)
@@ -297,8 +521,8 @@ class ControlWidget(QtWidgets.QWidget):
         self.rightTab.addTab(macroTab, "Macro")
         
         vlytshow = QVBoxLayout()
-        vlytshow.addWidget(self.btn_openPreview)
-        vlytshow.addWidget(self.lbl_pixel_info)
+        vlytshow.addLayout(previewLayout)
+        vlytshow.addLayout(pixelInfoLayout)
         vlytshow.addWidget(self.lbl_video, 3)
         vlytshow.addWidget(self.rightTab, 2)
         
@@ -339,6 +563,11 @@ class ControlWidget(QtWidgets.QWidget):
         self.flip_y = not self.flip_y
         logging.info("Flip Y toggled: %s", self.flip_y)
 
+    def onStretchChanged(self, mode):
+        """Select the preview stretch mode."""
+        self.stretcher.mode = mode
+        logging.info("Preview stretch: %s", mode)
+
     def openPreviewWindow(self):
         """
         Opens the independent preview window.
@@ -349,6 +578,13 @@ class ControlWidget(QtWidgets.QWidget):
         self.previewWindow.show()
         self.previewWindow.raise_()  # Optional: bring to front
 
+    def onAdaptivePreviewToggled(self, checked):
+        """
+        Enables/disables the adaptive preview rate; when disabled the maximum rate is used.
+        """
+        self.previewScheduler.adaptive = checked
+        self.previewScheduler.setMaxFps(self.spin_preview_fps.value())
+
     def updateCustomStyleSheet(self):
         """
         Applies a custom stylesheet based on self.text_color.
@@ -383,7 +619,7 @@ class ControlWidget(QtWidgets.QWidget):
         from PyQt5.QtWidgets import QMessageBox
         from PyQt5.QtGui import QDesktopServices
         
-        directory = self.le_directory.text().strip()
+        directory = self.outputLayout.lastDirectory or self.le_directory.text().strip()
         if directory:
             QDesktopServices.openUrl(QUrl.fromLocalFile(directory))
         else:
@@ -413,6 +649,21 @@ class ControlWidget(QtWidgets.QWidget):
             except nncam.HRESULTException as e:
                 QMessageBox.warning(self, "Error", f"Failed to set gain: {e}")
     
+    @log_exceptions
+    def onWriterThreadsChanged(self, value):
+        """
+        Resizes the pool of disk writer threads (and of compression processes, one per thread).
+        """
+        self.diskWriter.setWorkers(value)
+        self.compressionPool.setWorkers(value)
+    
+    @log_exceptions
+    def onWriterPolicyChanged(self, index):
+        """
+        Changes the back-pressure policy applied when the writer queue is full.
+        """
+        self.diskWriter.policy = self.cmb_writer_policy.itemData(index)
+    
     @log_exceptions
     def onBrowseDirectory(self, checked=False):
         """
@@ -425,8 +676,25 @@ class ControlWidget(QtWidgets.QWidget):
     @log_exceptions
     def onTimer(self):
         """
-        Called periodically to update information such as FPS, temperature, etc.
+        Called periodically to update information such as FPS, temperature, writer load, etc.
         """
+        st = self.diskWriter.stats()
+        self.lbl_writer.setText(
+            f"Writer: queue {st['queue']}/{st['maxQueue']} (+{st['spilledPending']} spilled), "
+            f"{st['bytesPerSec'] / 1e6:.1f} MB/s, "
+            f"latency {st['latencyAvg'] * 1000:.0f}/{st['latencyMax'] * 1000:.0f} ms, "
+            f"dropped {st['dropped']}, copied out of the frame pool {st['detached']}, "
+            f"pool starved {self.acqWorker.poolStarved if self.acqWorker is not None else 0}"
+            + "".join(f"\nCompression worker {w['pid']}: {w['files']} files, ratio {w['ratio']:.2f}, "
+                      f"{w['mbPerSec']:.1f} MB/s" for w in self.compressionPool.stats())
+        )
+        ql = self.quickLook.stats()
+        if ql['encoded'] or ql['dropped'] or ql['failed']:
+            self.lbl_writer.setText(
+                self.lbl_writer.text() +
+                f"\nQuick-look: {ql['encoded']} written ({ql['avgMs']:.0f} ms each), "
+                f"{ql['pending']} pending, {ql['dropped']} dropped"
+            )
         if self.hcam:
             nFrame, nTime, nTotalFrame = self.hcam.get_FrameRate()
             expotime = self.hcam.get_ExpoTime() / 1e6
@@ -445,10 +713,15 @@ class ControlWidget(QtWidgets.QWidget):
         """
         Closes the camera (if open) and disables controls.
         """
+        if self.trigger_remaining:
+            self.endBurst()
+        self.stopAcquisition()
+        self.closeFitsCube()
+        self.closeSessionArchive()
+        self.closeRawContainer()
         if self.hcam:
             self.hcam.Close()
         self.hcam = None
-        self.pData = None
         self.btn_open.setText("Turn On Camera")
         self.timer.stop()
         self.lbl_frame.clear()
@@ -462,15 +735,23 @@ class ControlWidget(QtWidgets.QWidget):
     
     def closeEvent(self, event):
         """
-        Window close event: closes the camera before exiting.
+        Window close event: closes the camera and flushes pending writes before exiting.
         """
         self.closeCamera()
+        self.closeFitsCube()
+        self.closeSessionArchive()
+        self.closeRawContainer()
+        self.diskWriter.close()
+        self.compressionPool.close()
+        self.quickLook.close()
+        self.outputLayout.close()
     
     @log_exceptions
     def onResolutionChanged(self, index):
         """
         Changes the camera resolution when another mode is selected in the combo box.
         """
+        self.stopAcquisition()
         if self.hcam:
             self.hcam.Stop()
         self.res = index
@@ -479,8 +760,6 @@ class ControlWidget(QtWidgets.QWidget):
         
         if self.hcam:
             self.hcam.put_eSize(self.res)
-            buffer_size = nncam.TDIBWIDTHBYTES(self.imgWidth * self.bitdepth) * self.imgHeight
-            self.pData = ctypes.create_string_buffer(buffer_size)
             self.startCamera()
             self.updateCameraSpecs()
     
@@ -506,9 +785,6 @@ class ControlWidget(QtWidgets.QWidget):
         self.hcam.put_Option(nncam.NNCAM_OPTION_BITDEPTH, self.bitdepth)
         self.hcam.put_Option(nncam.NNCAM_OPTION_TRIGGER, 0)  # Disables hardware trigger mode, if available
         
-        buffer_size = nncam.TDIBWIDTHBYTES(self.imgWidth * self.bitdepth) * self.imgHeight
-        self.pData = ctypes.create_string_buffer(buffer_size)
-        
         uimin, uimax, uidef = self.hcam.get_ExpTimeRange()
         self.spin_expoTime.setRange(uimin, uimax)
         self.spin_expoTime.setValue(uidef)
@@ -535,9 +811,39 @@ class ControlWidget(QtWidgets.QWidget):
             
             bAuto = self.hcam.get_AutoExpoEnable()
             self.cbox_auto.setChecked(1 == bAuto)
+            self.startAcquisition()
         
         self.timer.start(1000)
     
+    def startAcquisition(self):
+        """
+        Starts the acquisition worker that owns the pull loop of the open camera.
+        """
+        self.stopAcquisition()
+        self.framePool = FramePool(self.imgWidth, self.imgHeight, self.bitdepth, self.FRAME_POOL_SIZE)
+        self.acqWorker = AcquisitionWorker(self.hcam, self.framePool, self)
+        self.acqWorker.frameReady.connect(self.handleImageEvent)
+        self.acqWorker.stillReady.connect(self.handleStillImageEvent)
+        self.acqWorker.start()
+        self.previewScheduler.start()
+    
+    def stopAcquisition(self):
+        """
+        Stops the acquisition worker (if running) before the camera is stopped or closed.
+        """
+        if self.acqWorker is not None:
+            self.acqWorker.stop()
+            self.acqWorker = None
+        self.previewScheduler.stop()
+        if self.currentFrame is not None:
+            self.currentFrame.release()
+            self.currentFrame = None
+        if self.displayedFrame is not None:
+            self.displayedFrame.release()
+            self.displayedFrame = None
+        self.previewGeometry = None
+        self.framePool = None
+    
     @log_exceptions
     def openCamera(self):
         """
@@ -614,28 +920,9 @@ class ControlWidget(QtWidgets.QWidget):
         """
         if self.hcam:
             if self.cur.model.still == 0:
-                # Non-still mode: save what is in pData
-                if self.pData is not None:
-                    img_format = QImage.Format_Grayscale16 if self.bitdepth > 8 else QImage.Format_Grayscale8
-                    bytesPerLine = nncam.TDIBWIDTHBYTES(self.imgWidth * self.bitdepth)
-                    image = QImage(self.pData, self.imgWidth, self.imgHeight, bytesPerLine, img_format)
-                    self.count += 1
-                    
-                    if self.cbox_save_jpeg.isChecked():
-                        image.save(f"pyqt{self.count}.jpg")
-                    
-                    if self.cbox_save_raw.isChecked():
-                        with open(f"pyqt{self.count}_raw.raw", "wb") as f:
-                            f.write(self.pData)
-                    
-                    if self.cbox_save_fits.isChecked():
-                        dtype = np.uint16 if self.bitdepth > 8 else np.uint8
-                        raw_arr = np.frombuffer(self.pData, dtype=dtype)
-                        stride = nncam.TDIBWIDTHBYTES(self.imgWidth * self.bitdepth)
-                        elems_per_row = stride // (self.bitdepth // 8)
-                        raw_arr = raw_arr.reshape((self.imgHeight, elems_per_row))
-                        raw_image = raw_arr[:, :self.imgWidth]
-                        self.saveFitsImage(raw_image)
+                # Non-still mode: save the latest frame published by the acquisition worker
+                if self.currentFrame is not None:
+                    self.saveFrame(self.currentFrame)
             else:
                 # Still mode: request the camera to Snap
                 self.save_capture = True
@@ -653,40 +940,112 @@ class ControlWidget(QtWidgets.QWidget):
     @log_exceptions
     def configureTrigger(self):
         """
-        Starts a series of sequential captures based on the value of spin_trigger_count.
+        Starts a burst of spin_trigger_count captures, requested from the camera with a single
+        command (SnapN or Trigger(n), see utils/burst.py); the frames are saved by
+        collectBurstFrame as they stream in.
         """
-        self.trigger_remaining = self.spin_trigger_count.value()
+        if self.trigger_remaining:
+            self.endBurst()
+        if not self.burstPreflight(self.spin_trigger_count.value()):
+            return
+        self.trigger_remaining = self.burstTotal = self.spin_trigger_count.value()
         self.circularProgress.setMaximum(self.trigger_remaining)
         self.circularProgress.setValue(0)
-        self.save_capture = True
-        self.startSoftwareTriggerCapture()
+        if self.cbox_fits_cube.isChecked():
+            self.beginFitsCube(self.outputPath(f"{self.le_file_prefix.text().strip()}{self.count + 1}_cube.fits"),
+                               self.trigger_remaining)
+        if self.cbox_save_raw.isChecked():
+            self.beginRawContainer(self.outputPath(f"{self.le_file_prefix.text().strip()}{self.count + 1}_burst.praw"),
+                                   self.trigger_remaining)
+        self.burstMode = burst_mode(self.cur.model)
+        self.burstStart = time.perf_counter()
+        logging.info("Burst of %d frames started (%s mode)", self.burstTotal, self.burstMode)
+        try:
+            start_burst(self.hcam, self.burstMode, self.res, self.burstTotal)
+        except nncam.HRESULTException as e:
+            self.endBurst()
+            QMessageBox.warning(self, "Error", f"Failed to start the burst: {e}")
+            return
+        self.burstTimer.start(self.burstFrameTimeout())
     
-    @log_exceptions
-    def startSoftwareTriggerCapture(self):
+    def burstPreflight(self, count: int) -> bool:
         """
-        Starts (or continues) the 'triggered' captures until trigger_remaining is exhausted.
+        Checks that the output directory can hold 'count' captures in the selected formats
+        (cubes and RAW containers of a burst are preallocated): refuses when it cannot, asks
+        when less than DISK_RESERVE of the volume would remain free.
         """
-        if self.trigger_remaining > 0:
+        directory = self.le_directory.text().strip()
+        plan = MacroPlan([{"captures": count, "exposure": self.manual_exposure or 0, "directory": directory}],
+                         self.imgWidth, self.imgHeight, self.bitdepth, self.saveFormats(),
+                         defaultDirectory=directory)
+        errors, warnings = plan.preflight()
+        if errors:
+            QMessageBox.critical(self, "Burst", "Not enough disk space:\n" + "\n".join(errors))
+            return False
+        if warnings:
+            answer = QMessageBox.question(self, "Burst", "\n".join(warnings) + "\n\nStart the burst anyway?",
+                                          QMessageBox.Yes | QMessageBox.No)
+            return answer == QMessageBox.Yes
+        return True
+    
+    def burstFrameTimeout(self) -> int:
+        """
+        Returns how long (ms) a burst may wait for its next frame: twice the exposure plus 1 s.
+        """
+        exposure = self.manual_exposure
+        if exposure is None:
             try:
-                self.onBtnSnap()
-            except Exception as e:
-                logging.exception("Error during trigger capture")
-                QMessageBox.warning(self, "Error", f"Error capturing image: {e}")
-            
-            self.trigger_remaining -= 1
-            completed = self.spin_trigger_count.value() - self.trigger_remaining
-            self.circularProgress.setValue(completed)
-            
-            QTimer.singleShot(self.manual_exposure // 1000 + 100, self.startSoftwareTriggerCapture)
+                exposure = self.hcam.get_ExpoTime()
+            except nncam.HRESULTException:
+                exposure = 0
+        return 2 * exposure // 1000 + 1000
+    
+    def collectBurstFrame(self, frame):
+        """
+        Saves one frame of the running burst and ends the burst after its last frame.
+        """
+        self.saveFrame(frame)
+        self.trigger_remaining -= 1
+        self.circularProgress.setValue(self.burstTotal - self.trigger_remaining)
+        if self.trigger_remaining > 0:
+            self.burstTimer.start(self.burstFrameTimeout())
         else:
-            self.save_capture = False
+            self.endBurst()
+    
+    @log_exceptions
+    def onBurstTimeout(self):
+        logging.warning("Burst stalled: no frame within the timeout, %d of %d frames missing",
+                        self.trigger_remaining, self.burstTotal)
+        self.endBurst()
+    
+    def endBurst(self):
+        """
+        Ends the running burst: cancels outstanding triggers and closes the burst outputs.
+        """
+        self.burstTimer.stop()
+        collected = self.burstTotal - self.trigger_remaining
+        elapsed = time.perf_counter() - self.burstStart
+        logging.info("Burst done: %d/%d frames in %.2f s (%.1f fps)", collected, self.burstTotal, elapsed,
+                     collected / elapsed if elapsed > 0 else 0)
+        if self.hcam:
+            end_burst(self.hcam, self.burstMode)
+        self.trigger_remaining = 0
+        self.burstMode = None
+        self.closeFitsCube()
+        self.closeRawContainer()
     
     @staticmethod
     @log_exceptions
     def eventCallBack(nEvent, self):
         """
-        Static callback that re-emits the event via self.evtCallback.
+        Static callback (SDK thread). Image events are consumed by the acquisition worker;
+        the remaining events are re-emitted via self.evtCallback.
         """
+        if nncam.NNCAM_EVENT_IMAGE == nEvent:
+            return
+        if nncam.NNCAM_EVENT_STILLIMAGE == nEvent and self.acqWorker is not None:
+            self.acqWorker.requestStill()
+            return
         self.evtCallback.emit(nEvent)
     
     @log_exceptions
@@ -695,12 +1054,8 @@ class ControlWidget(QtWidgets.QWidget):
         Handles the camera events received via the callback.
         """
         if self.hcam:
-            if nncam.NNCAM_EVENT_IMAGE == nEvent:
-                self.handleImageEvent()
-            elif nncam.NNCAM_EVENT_EXPOSURE == nEvent:
+            if nncam.NNCAM_EVENT_EXPOSURE == nEvent:
                 self.handleExpoEvent()
-            elif nncam.NNCAM_EVENT_STILLIMAGE == nEvent:
-                self.handleStillImageEvent()
             elif nncam.NNCAM_EVENT_ERROR == nEvent:
                 self.closeCamera()
                 QMessageBox.warning(self, "Warning", "Generic Error.")
@@ -709,63 +1064,70 @@ class ControlWidget(QtWidgets.QWidget):
                 QMessageBox.warning(self, "Warning", "Camera disconnect.")
     
     @log_exceptions
-    def handleImageEvent(self):
+    def handleImageEvent(self, frame):
         """
-        Extracts the image from the buffer in Pull mode and displays it in lbl_video;
-        additionally, if save_capture is active, saves it (FITS).
+        Receives a pooled Frame published by the acquisition worker, saves it if a video or
+        trigger burst is running and offers it to the preview scheduler, which renders at its own rate.
+        The frame is kept as currentFrame until the next frame arrives.
         """
-        try:
-            self.hcam.PullImageV4(self.pData, 0, self.bitdepth, 0, None)
-        except nncam.HRESULTException:
-            pass
-        else:
-            dtype = np.uint16 if self.bitdepth > 8 else np.uint8
-            raw_arr = np.frombuffer(self.pData, dtype=dtype)
-            
-            stride = nncam.TDIBWIDTHBYTES(self.imgWidth * self.bitdepth)
-            elems_per_row = stride // (self.bitdepth // 8)
-            raw_arr = raw_arr.reshape((self.imgHeight, elems_per_row))
-            
-            raw_image = raw_arr[:, :self.imgWidth]
-            self.lastRawImage = raw_image.copy()
-            
-            # Convert to 8-bit for preview
-            if self.bitdepth > 8:
-                preview_arr = (raw_image.astype(np.float32) / (2**self.bitdepth - 1) * 255).astype(np.uint8)
-            else:
-                preview_arr = raw_image
-            
-            image_preview = QImage(preview_arr.data, self.imgWidth, self.imgHeight,
-                        self.imgWidth, QImage.Format_Grayscale8)
-            newimage = image_preview.scaled(self.lbl_video.width(), self.lbl_video.height(), Qt.KeepAspectRatio, Qt.FastTransformation)
-
-            # Apply flip based on the flags
-            if self.flip_x or self.flip_y:
-                # The mirrored() function takes two booleans: (horizontal, vertical)
-                newimage = newimage.mirrored(self.flip_x, self.flip_y)
+        if not self.hcam or frame.pool is not self.framePool:
+            # Stale frame queued before the camera was stopped or the resolution changed
+            frame.release()
+            return
+        if self.currentFrame is not None:
+            self.currentFrame.release()
+        self.currentFrame = frame
+        self.frameCounter += 1
+        
+        self.previewScheduler.submit(frame)
+        self.frameReceived.emit(frame)
+        
+        if self.trigger_remaining > 0 and self.burstMode != BURST_STILL:
+            self.collectBurstFrame(frame)
+    
+    @log_exceptions
+    def renderPreview(self, frame):
+        """
+        Reduces a frame to the display size, stretches it to 8 bits, displays it in lbl_video
+        (and the preview window) and refreshes the histogram and pixel info.
+        Called by the preview scheduler.
+        """
+        raw_image = frame.data
+        
+        # Decimate to the label size first, so only displayed pixels are converted
+        factor = decimation_factor(frame.width, frame.height, self.lbl_video.width(), self.lbl_video.height())
+        small = decimate(raw_image, factor, self.cmb_decimation.currentText())
+        
+        # Apply flip based on the flags (views, no copy)
+        if self.flip_x:
+            small = small[:, ::-1]
+        if self.flip_y:
+            small = small[::-1, :]
+        
+        # Convert to 8-bit for preview through the stretch lookup table
+        preview_arr = self.stretcher.apply(small, frame.bitdepth)
+        
+        height, width = preview_arr.shape
+        image_preview = QImage(preview_arr.data, width, height, width, QImage.Format_Grayscale8)
+        newimage = image_preview.scaled(self.lbl_video.width(), self.lbl_video.height(), Qt.KeepAspectRatio, Qt.FastTransformation)
 
-            self.currentPreviewImage = newimage
-            self.lbl_video.setPixmap(QtGui.QPixmap.fromImage(newimage))
+        self.currentPreviewImage = newimage
+        self.lbl_video.setPixmap(QtGui.QPixmap.fromImage(newimage))
+        
+        # Keep the displayed frame and its geometry for the pixel inspector
+        if self.displayedFrame is not None:
+            self.displayedFrame.release()
+        self.displayedFrame = frame.retain()
+        self.previewGeometry = PreviewGeometry(self.lbl_video.width(), self.lbl_video.height(),
+                                               newimage.width(), newimage.height(),
+                                               width, height, factor, self.flip_x, self.flip_y)
 
-            # If the independent preview window is open, update it as well
-            if self.previewWindow is not None:
-                self.previewWindow.setImage(newimage)
-            
-            self.updateHistogramRaw(raw_image)
-            self.updatePixelCount()
-            
-            if self.save_capture and self.cbox_save_fits.isChecked():
-                self.count += 1
-                self.saveFitsImage(raw_image)
-                self.trigger_remaining -= 1
-                if self.trigger_remaining > 0:
-                    try:
-                        self.hcam.TriggerSoftware()
-                    except Exception as e:
-                        logging.exception("Error executing TriggerSoftware")
-                        #QMessageBox.warning(self, "Error", f"Error triggering: {e}")
-                else:
-                    self.save_capture = False
+        # If the independent preview window is open, update it as well
+        if self.previewWindow is not None:
+            self.previewWindow.setImage(newimage)
+        
+        self.updateHistogramRaw(frame)
+        self.updatePixelCount()
     
     @log_exceptions
     def handleExpoEvent(self):
@@ -802,117 +1164,329 @@ class ControlWidget(QtWidgets.QWidget):
                     self.spin_expoGain.blockSignals(False)
     
     @log_exceptions
-    def handleStillImageEvent(self):
+    def handleStillImageEvent(self, frame):
         """
-        When a still image is received, extracts it and saves it to disk.
+        When a still Frame is received from the acquisition worker, queues it for saving
+        (as part of the running SnapN burst, if any).
         """
-        info = nncam.NncamFrameInfoV3()
-        try:
-            self.hcam.PullImageV3(None, 1, self.bitdepth, 0, info)
-        except nncam.HRESULTException:
-            pass
+        if not self.hcam:
+            return
+        # The macro sequencer may finish on this frame (and clear macroActive) during the emit
+        macroActive = self.macroActive
+        self.frameReceived.emit(frame)
+        if macroActive:
+            return
+        if self.trigger_remaining > 0 and self.burstMode == BURST_STILL:
+            self.collectBurstFrame(frame)
         else:
-            if info.width > 0 and info.height > 0:
-                bytesPerLine = nncam.TDIBWIDTHBYTES(info.width * self.bitdepth)
-                buffer_size = bytesPerLine * info.height
-                buf = ctypes.create_string_buffer(buffer_size)
-                
-                try:
-                    self.hcam.PullImageV3(buf, 1, self.bitdepth, 0, info)
-                except nncam.HRESULTException:
-                    pass
-                else:
-                    img_format = QImage.Format_Grayscale16 if self.bitdepth > 8 else QImage.Format_Grayscale8
-                    image = QImage(buf, info.width, info.height, bytesPerLine, img_format)
-                    
-                    self.count += 1
-                    # Save to disk
-                    if self.cbox_save_jpeg.isChecked():
-                        self.saveJPEGImage(image)
-                    if self.cbox_save_raw.isChecked():
-                        self.saveRAWImage(buf)
-                    if self.cbox_save_fits.isChecked():
-                        dtype = np.uint16 if self.bitdepth > 8 else np.uint8
-                        raw_arr = np.frombuffer(buf, dtype=dtype)
-                        stride = nncam.TDIBWIDTHBYTES(info.width * self.bitdepth)
-                        elems_per_row = stride // (self.bitdepth // 8)
-                        raw_arr = raw_arr.reshape((info.height, elems_per_row))
-                        raw_image = raw_arr[:, :info.width]
-                        self.saveFitsImage(raw_image)
-                    
-                    self.save_capture = False
+            self.saveFrame(frame)
+        
+        self.save_capture = False
+    
+    def saveFormats(self, fits=None) -> dict:
+        """
+        Describes what a capture writes with the current Save options, for size estimates
+        (see utils/macro_plan.frame_bytes); 'fits' overrides the Save FITS checkbox.
+        The FITS compression ratio is the one measured by the compression workers, if any.
+        """
+        fitsRatio = 1.0
+        if self.cmb_fits_compression.currentData() != COMPRESSION_NONE:
+            ratios = [w['ratio'] for w in self.compressionPool.stats() if w['ratio'] > 0]
+            if ratios:
+                fitsRatio = min(ratios)
+        packBits = self.bitdepth if self.cbox_pack_raw.isChecked() and self.bitdepth in PACKABLE_BITS else None
+        return {
+            'fits': self.cbox_save_fits.isChecked() if fits is None else fits,
+            'fitsRatio': fitsRatio,
+            'raw': self.cbox_save_raw.isChecked(),
+            'packBits': packBits,
+            'quicklook': self.cmb_quicklook_format.currentText() if self.cbox_save_jpeg.isChecked() else None,
+        }
+    
+    def saveFrame(self, frame):
+        """
+        Saves a captured frame in every format selected in the Save options.
+        """
+        self.count += 1
+        if self.cbox_save_jpeg.isChecked():
+            self.saveQuickLookImage(frame)
+        if self.cbox_save_raw.isChecked():
+            self.saveRAWImage(frame)
+        if self.cbox_save_fits.isChecked():
+            self.saveFitsImage(frame)
+    
+    def defaultFilename(self, ext: str) -> str:
+        """
+        Returns the path of '<prefix><count>.<ext>' in the output directory (see outputPath).
+        """
+        return self.outputPath(f"{self.le_file_prefix.text().strip()}{self.count}.{ext}")
+    
+    def outputPath(self, name: str, root: str = None) -> str:
+        """
+        Returns the path for a new file 'name' below 'root' (default: the File Settings
+        directory), placed in the session/night/shard directory of the output layout.
+        """
+        return self.outputLayout.path(root or self.le_directory.text().strip(), name)
     
     @log_exceptions
-    def saveJPEGImage(self, image: QImage):
+    def onOutputLayoutChanged(self, *args):
         """
-        Saves the image in JPEG format in the directory with the configured prefix.
+        Applies the output layout settings; the next file starts a new session.
         """
-        jpeg_filename = f"{self.le_directory.text().strip()}/{self.le_file_prefix.text().strip()}{self.count}.jpg"
-        image.save(jpeg_filename)
+        shard = self.cmb_output_shard.currentData()
+        self.spin_shard_files.setEnabled(shard == SHARD_FILES)
+        self.outputLayout.configure(self.cmb_output_layout.currentData(), shard, self.spin_shard_files.value())
     
     @log_exceptions
-    def saveRAWImage(self, raw_image):
+    def saveQuickLookImage(self, frame, name=None, root=None):
         """
-        Saves the RAW buffer to a .raw file.
+        Queues a JPEG/PNG quick-look of the frame in the directory with the configured prefix
+        (or as 'name', without extension, below 'root'), stretched with the current preview
+        settings and encoded by the quick-look pool.
         """
-        raw_filename = f"{self.le_directory.text().strip()}/{self.le_file_prefix.text().strip()}{self.count}.raw"
-        with open(raw_filename, "wb") as f:
-            f.write(raw_image)
+        ext = self.cmb_quicklook_format.currentText()
+        path = self.outputPath(f"{name}.{ext}", root) if name else self.defaultFilename(ext)
+        self.quickLook.submit(path, frame, self.stretcher.mode, self.stretcher.percentiles)
+    
+    def onQuickLookQualityChanged(self, value):
+        self.quickLook.quality = value
+    
+    def onThumbnailSizeChanged(self, value):
+        self.quickLook.thumbnail = value
     
     @log_exceptions
-    def saveFitsImage(self, raw_image: np.ndarray):
+    def saveRAWImage(self, frame):
         """
-        Saves the image in FITS format, including metadata such as exposure, gain, temperature, etc.
+        Queues the frame's unpadded pixels for the packed RAW container (see utils/raw_container.py):
+        the burst container while a trigger burst runs, a session container otherwise.
+        A frame of another geometry (e.g. a still image) starts a new container, as does
+        toggling bit-packing.
         """
-        hdr = fits.Header()
-        if self.manual_exposure is not None:
-            hdr['EXPTIME'] = (self.manual_exposure / 1e6, "Exposure time in seconds")
+        packBits = 0
+        if self.cbox_pack_raw.isChecked() and frame.data.dtype == np.uint16 and frame.bitdepth in PACKABLE_BITS:
+            packBits = frame.bitdepth
+        container = self.rawContainer
+        if container is not None and (container.shape != frame.data.shape or container.dtype != frame.data.dtype
+                                      or container.packBits != packBits):
+            self.closeRawContainer()
+            container = None
+        if container is None:
+            path = self.rawContainerPath
+            if path is None:
+                stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+                path = self.outputPath(f"{self.le_file_prefix.text().strip()}session_{stamp}.praw")
+            try:
+                container = PackedRawWriter(path, frame.data.shape, frame.data.dtype, frame.bitdepth,
+                                            self.rawContainerFrames, packBits or None)
+            except OSError as e:
+                # No room to preallocate: write the frames as they come
+                logging.warning("Cannot preallocate %s (%s), streaming the container", path, e)
+                container = PackedRawWriter(path, frame.data.shape, frame.data.dtype, frame.bitdepth,
+                                            None, packBits or None)
+            self.rawContainer = container
+            self.rawContainerPath = path
+            logging.info("RAW container opened: %s", path)
+        self.appendSlottedFrame(container, frame, self.fitsCards(frame))
+    
+    def beginRawContainer(self, filename, frames=None):
+        """
+        Sends the following RAW saves to the container 'filename' (closing the current one),
+        preallocated for 'frames' frames when that number is known.
+        """
+        self.closeRawContainer()
+        self.rawContainerPath = filename
+        self.rawContainerFrames = frames
+    
+    def closeRawContainer(self):
+        """
+        Closes the RAW container; the disk writer finalizes it after its last queued frame.
+        The next RAW save outside a burst opens a new session container.
+        """
+        if self.rawContainer is not None:
+            self.rawContainer.close()
+        self.rawContainer = None
+        self.rawContainerPath = None
+        self.rawContainerFrames = None
+    
+    def fitsCards(self, frame=None, exposure=None, gain=None) -> dict:
+        """
+        Collects the FITS header cards describing the current capture settings
+        (exposure, gain, temperature, geometry, camera, capture time).
+        Exposure and gain come from the 'frame' metadata when the camera reported them,
+        otherwise from 'exposure'/'gain' when given (a macro may already have applied the next
+        step's settings when the frame is saved), otherwise from the current settings.
+        Must be called on the GUI thread, at capture time.
+        """
+        cards = {}
+        if frame is not None and frame.expotime:
+            cards['EXPTIME'] = (frame.expotime / 1e6, "Exposure time in seconds")
+        elif exposure is not None:
+            cards['EXPTIME'] = (exposure / 1e6, "Exposure time in seconds")
+        elif self.manual_exposure is not None:
+            cards['EXPTIME'] = (self.manual_exposure / 1e6, "Exposure time in seconds")
         else:
             try:
-                hdr['EXPTIME'] = (self.hcam.get_ExpoTime() / 1e6, "Exposure time in seconds")
+                cards['EXPTIME'] = (self.hcam.get_ExpoTime() / 1e6, "Exposure time in seconds")
             except:
-                hdr['EXPTIME'] = ('N/A', "Exposure time in seconds")
-        
-        if self.manual_gain is not None:
-            hdr['GAIN'] = (self.manual_gain, "Gain in percentage")
+                cards['EXPTIME'] = ('N/A', "Exposure time in seconds")
+        
+        if frame is not None and frame.expotime:
+            cards['GAIN'] = (frame.expogain, "Gain in percentage")
+        elif gain is not None:
+            cards['GAIN'] = (gain, "Gain in percentage")
+        elif self.manual_gain is not None:
+            cards['GAIN'] = (self.manual_gain, "Gain in percentage")
         else:
             try:
-                hdr['GAIN'] = self.hcam.get_ExpoAGain()
+                cards['GAIN'] = self.hcam.get_ExpoAGain()
             except:
-                hdr['GAIN'] = 'N/A'
+                cards['GAIN'] = 'N/A'
         
         try:
-            hdr['TEMP'] = self.hcam.get_Temperature() / 10
+            cards['TEMP'] = self.hcam.get_Temperature() / 10
         except:
-            hdr['TEMP'] = 'N/A'
+            cards['TEMP'] = 'N/A'
         
-        hdr['WIDTH'] = self.imgWidth
-        hdr['HEIGHT'] = self.imgHeight
-        hdr['BITDEPTH'] = self.bitdepth
+        cards['WIDTH'] = self.imgWidth
+        cards['HEIGHT'] = self.imgHeight
+        cards['BITDEPTH'] = self.bitdepth
         
         if hasattr(self, 'cur') and hasattr(self.cur, 'displayname'):
-            hdr['CAMERA'] = self.cur.displayname
+            cards['CAMERA'] = self.cur.displayname
         else:
-            hdr['CAMERA'] = 'Unknown'
-        
-        hdr['DATAMEAN'] = f"{np.mean(raw_image):.3f}"
-        hdr['DATAMED']  = f"{np.median(raw_image):.3f}"
-        hdr['DATASTD']  = f"{np.std(raw_image):.3f}"
-        hdr['DATAMAX']  = f"{np.max(raw_image):.3f}"
-        hdr['DATAMIN']  = f"{np.min(raw_image):.3f}"
+            cards['CAMERA'] = 'Unknown'
         
-        hdr['CAPTIME']  = datetime.datetime.now().isoformat()
-        
-        hdu = fits.PrimaryHDU(data=raw_image, header=hdr)
-        hdul = fits.HDUList([hdu])
-        
-        fits_filename = f"{self.le_directory.text().strip()}/{self.le_file_prefix.text().strip()}{self.count}.fits"
-        hdul.writeto(fits_filename, overwrite=True)
-        logging.info("FITS file saved: %s", fits_filename)
+        cards['CAPTIME'] = datetime.datetime.now().isoformat()
+        return cards
+    
+    @log_exceptions
+    def saveFitsImage(self, frame, name=None, root=None, exposure=None, gain=None, onWritten=None):
+        """
+        Queues the frame to be saved in FITS format, including metadata such as exposure, gain, temperature, etc.
+        The header cards are collected now; statistics and encoding happen in the disk writer.
+        With the HDF5 session archive enabled, or while a FITS cube is open, the frame is
+        appended there instead of going to its own file.
+        The file is '<prefix><count>.fits', or 'name' below 'root', in the output layout.
+        'exposure' and 'gain' are the capture settings, for frames without that metadata.
+        'onWritten' is called with the WriteJob (writer thread) once the frame is written.
+        Returns the path the frame was queued for, or None if it was dropped.
+        """
+        cards = self.fitsCards(frame, exposure, gain)
+        if self.cbox_hdf5_archive.isChecked():
+            return self.appendSessionArchive(frame, cards, onWritten)
+        if self.fitsCubePath is not None:
+            return self.appendFitsCube(frame, cards, onWritten)
+        fits_filename = self.outputPath(name, root) if name else self.defaultFilename("fits")
+        compression = self.cmb_fits_compression.currentData()
+        if compression != COMPRESSION_NONE:
+            job = WriteJob(fits_filename, write_fits_compressed, frame.data, frame.retain(), onWritten,
+                           cards=cards, bitdepth=frame.bitdepth,
+                           pool=self.compressionPool, compression=compression)
+        else:
+            job = WriteJob(fits_filename, write_fits, frame.data, frame.retain(), onWritten,
+                           cards=cards, bitdepth=frame.bitdepth, histogram=frame.exactHistogram)
+        if not self.diskWriter.submit(job):
+            return None
+        self.outputLayout.record(fits_filename, frame)
+        logging.info("FITS file queued: %s", fits_filename)
+        return fits_filename
+    
+    def beginFitsCube(self, filename, frames=None):
+        """
+        Starts collecting the FITS saves into the cube 'filename' (closing any previous cube).
+        The file is created with the first frame, which fixes the cube shape; when the number
+        of 'frames' is known the file is preallocated and written through a memory map.
+        """
+        self.closeFitsCube()
+        self.fitsCubePath = filename
+        self.fitsCubeFrames = frames
+    
+    def appendFitsCube(self, frame, cards=None, onWritten=None):
+        """
+        Queues the frame for the open FITS cube and returns the cube path (None if dropped).
+        """
+        cards = cards or self.fitsCards(frame)
+        if self.fitsCube is None:
+            try:
+                self.fitsCube = FitsCube(self.fitsCubePath, frame.data.shape, frame.data.dtype, cards,
+                                         self.fitsCubeFrames)
+            except OSError as e:
+                # No room to preallocate: write the frames as they come
+                logging.warning("Cannot preallocate %s (%s), streaming the cube", self.fitsCubePath, e)
+                self.fitsCube = FitsCube(self.fitsCubePath, frame.data.shape, frame.data.dtype, cards)
+            logging.info("FITS cube opened: %s", self.fitsCubePath)
+        return self.appendSlottedFrame(self.fitsCube, frame, cards, onWritten)
+    
+    def appendSessionArchive(self, frame, cards=None, onWritten=None):
+        """
+        Queues the frame for the HDF5 session archive, opening a new archive on the first
+        frame (or when the frame geometry changes).
+        """
+        cards = cards or self.fitsCards(frame)
+        archive = self.sessionArchive
+        if archive is not None and (archive.shape != frame.data.shape or archive.dtype != frame.data.dtype):
+            self.closeSessionArchive()
+            archive = None
+        if archive is None:
+            stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            path = self.outputPath(f"{self.le_file_prefix.text().strip()}session_{stamp}.h5")
+            archive = Hdf5Archive(path, frame.data.shape, frame.data.dtype, cards,
+                                  self.cmb_archive_filter.currentData())
+            self.sessionArchive = archive
+            logging.info("HDF5 archive opened: %s", path)
+        return self.appendSlottedFrame(archive, frame, cards, onWritten)
+    
+    def appendSlottedFrame(self, output, frame, cards, onWritten=None):
+        """
+        Reserves the next slot of a multi-frame output and queues the frame for it,
+        with its per-frame metadata row. Returns the output path, or None if the frame was dropped.
+        """
+        row = {
+            'SEQ': frame.seq,
+            'TIMESTAMP': frame.timestamp,
+            'EXPTIME': frame.expotime / 1e6,
+            'GAIN': frame.expogain,
+            'BLACKLEVEL': frame.blacklevel,
+            'TEMP': cards.get('TEMP'),
+        }
+        slot = output.reserve()
+        if self.diskWriter.submit(WriteJob(output.path, write_slotted_frame, frame.data, frame.retain(), onWritten,
+                                           output=output, slot=slot, row=row)):
+            self.outputLayout.record(output.path, frame, slot)
+            return output.path
+        output.cancel(slot)
+        return None
+    
+    def closeFitsCube(self):
+        """
+        Closes the open FITS cube; the disk writer finalizes it after its last queued frame.
+        """
+        if self.fitsCube is not None:
+            self.fitsCube.close()
+        self.fitsCube = None
+        self.fitsCubePath = None
+        self.fitsCubeFrames = None
+    
+    def closeSessionArchive(self):
+        """
+        Closes the HDF5 session archive; the disk writer finalizes it after its last queued frame.
+        """
+        if self.sessionArchive is not None:
+            self.sessionArchive.close()
+        self.sessionArchive = None
+    
+    def onSessionArchiveToggled(self, checked):
+        """
+        Turning the session archive off closes it; the next session starts a new file.
+        """
+        self.cmb_archive_filter.setEnabled(not checked)
+        if not checked:
+            self.closeSessionArchive()
     
     def updatePixelCount(self, event=None):
         """
-        Updates the lbl_pixel_info label with the mouse position and the pixel value in the 16/8-bit image.
+        Updates the lbl_pixel_info label with the raw position under the mouse, the pixel value
+        and the mean/max of its N x N neighbourhood, read from the displayed frame.
         """
         if event is None:
             if hasattr(self.lbl_video, 'lastMousePos') and self.lbl_video.lastMousePos is not None:
@@ -923,51 +1497,71 @@ class ControlWidget(QtWidgets.QWidget):
         else:
             pos = event.pos() if hasattr(event, 'pos') else event
         
-        pm = self.lbl_video.pixmap()
-        if pm is None:
+        if self.previewGeometry is None or self.displayedFrame is None:
             self.lbl_pixel_info.setText("No image loaded")
             return
         
-        pm_width = pm.width()
-        pm_height = pm.height()
-        label_width = self.lbl_video.width()
-        label_height = self.lbl_video.height()
-        
-        x_offset = (label_width - pm_width) // 2
-        y_offset = (label_height - pm_height) // 2
-        
-        x = pos.x() - x_offset
-        y = pos.y() - y_offset
+        raw = self.previewGeometry.toRaw(pos.x(), pos.y())
+        if raw is None:
+            self.lbl_pixel_info.setText("Pixel info:")
+            return
         
-        if 0 <= x < pm_width and 0 <= y < pm_height:
-            qimg = pm.toImage()
-            color = QColor(qimg.pixel(x, y))
-            
-            # Map to the original RAW image
-            raw_x = int(x * (self.imgWidth / pm_width))
-            raw_y = int(y * (self.imgHeight / pm_height))
-            
-            if hasattr(self, 'lastRawImage'):
-                value = self.lastRawImage[raw_y, raw_x]
-                self.lbl_pixel_info.setText(f"Pos: ({raw_x}, {raw_y}) - Counts: {value}")
-            else:
-                self.lbl_pixel_info.setText(f"Pos: ({x}, {y}) - Gray: {color.red()}")
+        raw_x, raw_y = raw
+        size = self.spin_inspect_size.value()
+        value, mean, peak = neighbourhood(self.displayedFrame.data, raw_x, raw_y, size)
+        self.lbl_pixel_info.setText(f"Pos: ({raw_x}, {raw_y}) - Counts: {value} - "
+                                    f"{size}x{size} mean: {mean:.1f}, max: {peak}")
+    
+    def updateHistogramRaw(self, frame):
+        """
+        Updates the histogram display from the received frame, at most once per HISTOGRAM_INTERVAL.
+        """
+        now = time.monotonic()
+        if now - self.lastHistogramTime < self.HISTOGRAM_INTERVAL:
+            return
+        self.lastHistogramTime = now
+        if frame.histogram is not None or not self.histogramEngine.subsample:
+            # Exact histogram, shared with the FITS statistics of the frame (counted once)
+            hist = frame.exactHistogram()
         else:
-            self.lbl_pixel_info.setText("Pixel info:")
+            hist = self.histogramEngine.compute(frame.data, frame.bitdepth, frame.seq)
+        self.histWidget.setHistogram(hist)
     
-    def updateHistogramRaw(self, raw_image: np.ndarray):
+    def onHistogramExactToggled(self, checked):
         """
-        Updates the histogram graph based on the received RAW image.
+        Switches the live histogram between a subsample and every pixel of the frame.
         """
-        max_val = 2**self.bitdepth - 1
-        n_bins = 256
-        hist, bins = np.histogram(raw_image.flatten(), bins=n_bins, range=(0, max_val))
-        
-        self.ax_hist.clear()
-        self.ax_hist.plot(bins[:-1], hist)
-        self.ax_hist.set_title(f"Histogram ({self.bitdepth}-bit)")
-        self.ax_hist.set_xlabel("Intensity")
-        self.ax_hist.set_ylabel("Counts")
+        self.histogramEngine.subsample = not checked
+    
+    @log_exceptions
+    def onExportHistogram(self, checked=False):
+        """
+        Exports the displayed histogram as an image (rendered with matplotlib).
+        """
+        hist = self.histWidget.histogram()
+        if hist is None:
+            QMessageBox.warning(self, "Warning", "No histogram to export.")
+            return
+        filename, _ = QFileDialog.getSaveFileName(self, "Export Histogram", self.le_directory.text(),
+                                                  "Images (*.png *.pdf *.svg)")
+        if not filename:
+            return
         
-        self.canvas_hist.draw()
-
+        # matplotlib is only needed here, so it is not imported at startup
+        import matplotlib.style
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        
+        with matplotlib.style.context('dark_background'):
+            figure = Figure(figsize=(6, 4))
+            FigureCanvasAgg(figure)
+            ax = figure.add_subplot(111)
+            values = np.cumsum(hist.counts) if self.histWidget.cumulative else hist.counts
+            ax.plot(np.arange(values.size), values)
+            if self.histWidget.logScale:
+                ax.set_yscale('log')
+            ax.set_title(f"Histogram ({hist.bitdepth}-bit)")
+            ax.set_xlabel("Intensity")
+            ax.set_ylabel("Cumulative counts" if self.histWidget.cumulative else "Counts")
+            figure.savefig(filename)
+        logging.info("Histogram exported: %s", filename)
@@ -0,0 +1,105 @@
+import numpy as np
+from PyQt5.QtCore import Qt, QPointF, QRectF
+from PyQt5.QtGui import QPainter, QPen, QColor, QPolygonF, QBrush
+from PyQt5.QtWidgets import QWidget
+
+
+class HistogramWidget(QWidget):
+    """
+    Lightweight histogram display drawn with QPainter.
+    The counts are rebinned to the widget width and drawn as a filled curve,
+    with optional log scale and cumulative views.
+    """
+    MARGIN = 24
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._histogram = None
+        self.logScale = False
+        self.cumulative = False
+        self._lineColor = QColor("#4CAF50")
+        self.setMinimumSize(200, 120)
+
+    def setHistogram(self, histogram):
+        """
+        Sets the Histogram to display and schedules a repaint.
+        """
+        self._histogram = histogram
+        self.update()
+
+    def histogram(self):
+        return self._histogram
+
+    def setLogScale(self, enabled: bool):
+        self.logScale = enabled
+        self.update()
+
+    def setCumulative(self, enabled: bool):
+        self.cumulative = enabled
+        self.update()
+
+    def setLineColor(self, color):
+        """
+        Set the color of the curve (can be a string or QColor).
+        """
+        self._lineColor = QColor(color)
+        self.update()
+
+    def _curve(self, columns: int) -> np.ndarray:
+        """
+        Returns the values to plot, rebinned to 'columns' points and normalized to [0, 1].
+        """
+        counts = self._histogram.counts
+        columns = max(1, min(columns, counts.size))
+        edges = np.linspace(0, counts.size, columns + 1).astype(np.intp)[:-1]
+        values = np.add.reduceat(counts, edges).astype(np.float64)
+        if self.cumulative:
+            values = np.cumsum(values)
+        if self.logScale:
+            values = np.log10(1 + values)
+        peak = values.max()
+        return values / peak if peak > 0 else values
+
+    def paintEvent(self, event):
+        """
+        Draws the axes, the histogram curve and the range labels.
+        """
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        rect = QRectF(self.rect()).adjusted(self.MARGIN, self.MARGIN / 2, -self.MARGIN / 2, -self.MARGIN)
+
+        axisPen = QPen(QColor("#888888"))
+        painter.setPen(axisPen)
+        painter.drawLine(rect.bottomLeft(), rect.bottomRight())
+        painter.drawLine(rect.bottomLeft(), rect.topLeft())
+
+        if self._histogram is None or rect.width() <= 1:
+            painter.drawText(self.rect(), Qt.AlignCenter, "No histogram")
+            return
+
+        values = self._curve(int(rect.width()))
+        n = values.size
+        xs = rect.left() + np.arange(n) * (rect.width() / max(1, n - 1))
+        ys = rect.bottom() - values * rect.height()
+
+        polygon = QPolygonF([QPointF(rect.left(), rect.bottom())])
+        for x, y in zip(xs, ys):
+            polygon.append(QPointF(x, y))
+        polygon.append(QPointF(rect.right(), rect.bottom()))
+
+        fill = QColor(self._lineColor)
+        fill.setAlpha(80)
+        painter.setBrush(QBrush(fill))
+        painter.setPen(QPen(self._lineColor, 1.5))
+        painter.drawPolygon(polygon)
+
+        painter.setPen(axisPen)
+        maxVal = 2**self._histogram.bitdepth - 1
+        labelRect = QRectF(rect.left(), rect.bottom() + 2, rect.width(), self.MARGIN - 2)
+        painter.drawText(labelRect, Qt.AlignLeft | Qt.AlignTop, "0")
+        painter.drawText(labelRect, Qt.AlignRight | Qt.AlignTop, str(maxVal))
+        mode = "cumulative" if self.cumulative else "counts"
+        if self.logScale:
+            mode += ", log"
+        painter.drawText(rect.adjusted(6, 2, 0, 0), Qt.AlignLeft | Qt.AlignTop,
+                         f"{self._histogram.bitdepth}-bit, {mode}")
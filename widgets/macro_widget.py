@@ -2,7 +2,7 @@ import csv
 from PyQt5.QtCore import pyqtSignal
 from PyQt5.QtWidgets import (
     QWidget, QTableWidget, QVBoxLayout, QHBoxLayout, QTableWidgetItem,
-    QPushButton, QFileDialog, QMessageBox, QHeaderView
+    QPushButton, QFileDialog, QMessageBox, QHeaderView, QCheckBox
 )
 from PyQt5.QtGui import QFont
 
@@ -11,8 +11,10 @@ class MacroModeWidget(QWidget):
     Widget that manages Macro Mode:
     - A table with columns [Captures, Exposure (us), Gain, Prefix, Directory]
     - Buttons to add/remove rows, load/save CSV, and start Macro capture.
+    - A button to resume an interrupted Macro from its journal.
     """
     macroStarted = pyqtSignal(list)
+    macroResumed = pyqtSignal(str)
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -45,13 +47,22 @@ class MacroModeWidget(QWidget):
         csvBtnLayout.addWidget(self.btnSaveCSV)
         layout.addLayout(csvBtnLayout)
         
+        # Run the exposure/gain ladder on the camera's sequencer trigger when supported
+        self.cbox_hw_sequencer = QCheckBox("Use camera sequencer when available")
+        self.cbox_hw_sequencer.setChecked(True)
+        layout.addWidget(self.cbox_hw_sequencer)
+        
         self.btnStartMacro = QPushButton("Start Macro Capture")
         layout.addWidget(self.btnStartMacro)
         
+        self.btnResumeMacro = QPushButton("Resume Macro...")
+        layout.addWidget(self.btnResumeMacro)
+        
         # Connections
         self.btnAdd.clicked.connect(self.addRow)
         self.btnRemove.clicked.connect(self.removeRow)
         self.btnStartMacro.clicked.connect(self.startMacro)
+        self.btnResumeMacro.clicked.connect(self.resumeMacro)
         self.btnLoadCSV.clicked.connect(self.loadCSV)
         self.btnSaveCSV.clicked.connect(self.saveCSV)
 
@@ -123,6 +134,14 @@ class MacroModeWidget(QWidget):
         else:
             QMessageBox.warning(self, "Warning", "No macro steps defined.")
     
+    def resumeMacro(self):
+        """
+        Opens a file dialog to pick the journal of an interrupted Macro and emits macroResumed.
+        """
+        filename, _ = QFileDialog.getOpenFileName(self, "Resume Macro", "", "Macro journal (*.journal)")
+        if filename:
+            self.macroResumed.emit(filename)
+    
     def loadCSV(self):
         """
         Opens a file dialog to load Macro steps from a CSV file.